@@ -3,24 +3,114 @@ import shlex
 from typing import Iterable
 
 
+class Arg:
+    # one add_argument() call of an option spec
+    def __init__(self, *names: str, **kwargs):
+        self.names = names
+        self.kwargs = kwargs
+
+
+class Group:
+    # mutually exclusive arguments
+    def __init__(self, *args: Arg):
+        self.args = args
+
+
+# Option spec given to @command(options=...). It is compiled into a parser on the
+# first call of the command and the parser is reused by every later call.
+class Options:
+    items: tuple[Arg | Group, ...]
+    parser: argparse.ArgumentParser | None
+
+    def __init__(self, *items: Arg | Group):
+        self.items = items
+        self.parser = None
+
+    def build(self):
+        parser = argparse.ArgumentParser(exit_on_error=False)
+        for item in self.items:
+            if isinstance(item, Group):
+                group = parser.add_mutually_exclusive_group()
+                for arg in item.args:
+                    group.add_argument(*arg.names, **arg.kwargs)
+            else:
+                parser.add_argument(*item.names, **item.kwargs)
+        return parser
+
+    def compile(self):
+        if self.parser is None:
+            self.parser = self.build()
+        return self.parser
+
+
 class Args(Iterable[str]):
     cmd: str
     raw: list[str]
-    parser: argparse.ArgumentParser
+    options: Options | None
 
-    def __init__(self, args: list[str]):
+    def __init__(self, args: list[str], options: Options | None = None):
         cmd, *args = args
         self.cmd = cmd
         self.raw = args
-        self.parser = argparse.ArgumentParser(exit_on_error=False)
-        self.add_argument = self.parser.add_argument
-        self.add_mutually_exclusive_group = self.parser.add_mutually_exclusive_group
+        self.options = options
+        self.__parser = None
 
     @staticmethod
     def parse(line: str):
         args = shlex.split(line)
         return Args(args)
 
+    @staticmethod
+    def split_background(line: str):
+        # a trailing "&" that is neither quoted nor escaped runs the command as a background job
+        line = line.rstrip()
+        if not line.endswith("&"):
+            return line, False
+        head = line[:-1]
+        slashes = len(head) - len(head.rstrip("\\"))
+        if slashes % 2 or head.endswith("&"):
+            return line, False
+        return head.rstrip(), True
+
+    @staticmethod
+    def split_pipeline(line: str):
+        # stage lines split on "|" outside quotes, and the target of a final "> FILE" or ">> FILE"
+        parts: list[str] = []
+        ops: list[str] = []
+        start = 0
+        quote = None
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if c == "\\" and quote != "'":
+                i += 2
+                continue
+            if quote:
+                if c == quote:
+                    quote = None
+            elif c in "'\"":
+                quote = c
+            elif c in "|>":
+                parts.append(line[start:i])
+                op = ">>" if line.startswith(">>", i) else c
+                ops.append(op)
+                i += len(op)
+                start = i
+                continue
+            i += 1
+        parts.append(line[start:])
+
+        redirect = None
+        if ops and ops[-1] != "|":
+            target = shlex.split(parts.pop())
+            if len(target) != 1:
+                raise Exception(f"syntax error near unexpected token `{ops[-1]}'")
+            redirect = (ops.pop(), target[0])
+        for op, part in zip(ops + [""], parts):
+            if op not in ("|", "") or not part.strip():
+                raise Exception(f"syntax error near unexpected token `{op or '|'}'")
+        return [part.strip() for part in parts], redirect
+
     def __getitem__(self, i: int):
         return self.raw[i]
 
@@ -34,5 +124,20 @@ class Args(Iterable[str]):
     def has(self, *items: str):
         return any(v in items for v in self.raw)
 
+    @property
+    def parser(self) -> argparse.ArgumentParser:
+        # built only for commands that add their arguments themselves
+        if self.__parser is None:
+            self.__parser = argparse.ArgumentParser(exit_on_error=False)
+        return self.__parser
+
+    def add_argument(self, *args, **kwargs):
+        return self.parser.add_argument(*args, **kwargs)
+
+    def add_mutually_exclusive_group(self, **kwargs):
+        return self.parser.add_mutually_exclusive_group(**kwargs)
+
     def parse_args(self):
+        if self.options is not None and self.__parser is None:
+            return self.options.compile().parse_args(self.raw)
         return self.parser.parse_args(self.raw)
@@ -0,0 +1,355 @@
+import argparse
+import gc
+import os
+import shlex
+import tempfile
+import time
+import tracemalloc
+
+from vfs import Vfs, load_dirs
+
+
+def count_scans():
+    scandir = os.scandir
+    calls = [0]
+
+    def counting_scandir(path):
+        calls[0] += 1
+        return scandir(path)
+
+    os.scandir = counting_scandir
+    return calls
+
+
+def bench_resolve(dirs: int, depth: int, rounds: int):
+    with tempfile.TemporaryDirectory() as root:
+        paths: list[str] = []
+        for i in range(dirs):
+            parts = [f"d{i}"] + [f"e{k}" for k in range(depth - 1)]
+            os.makedirs(os.path.join(root, *parts))
+            paths.append("/" + "/".join(parts))
+        vfs = Vfs()
+        vfs.init(root)
+        scans = count_scans()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for path in paths:
+                vfs.find(path)
+                vfs.find(path + "/missing")
+        elapsed = time.perf_counter() - start
+        lookups = 2 * dirs * rounds
+        print(f"resolve: {dirs} empty dir chains of depth {depth}, {lookups} lookups")
+        print(f"  {elapsed * 1000:.1f} ms total, {elapsed / lookups * 1e6:.2f} us/lookup, "
+              f"{scans[0]} directory scans")
+
+
+def load_tree(vfs: Vfs):
+    nodes = 0
+    stack = [vfs.cwd]
+    while stack:
+        item = stack.pop()
+        nodes += 1
+        if item.is_dir:
+            stack.extend(item.listdir())
+        else:
+            item.size()
+    return nodes
+
+
+def bench_memory(dirs: int, files: int):
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(dirs):
+            d = os.path.join(root, f"d{i}")
+            os.mkdir(d)
+            for k in range(files):
+                open(os.path.join(d, f"file{k}.txt"), "wb").close()
+        print(f"memory: {dirs} dirs x {files} files")
+        for compact in (False, True):
+            start = time.perf_counter()
+            vfs = Vfs(compact=compact)
+            vfs.init(root)
+            load_tree(vfs)
+            elapsed = time.perf_counter() - start
+            del vfs
+            # second load under tracemalloc, which would skew the timing above
+            gc.collect()
+            tracemalloc.start()
+            vfs = Vfs(compact=compact)
+            vfs.init(root)
+            nodes = load_tree(vfs)
+            gc.collect()
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del vfs
+            print(f"  {'compact' if compact else 'objects':8} {used / 1024 ** 2:7.1f} MB, "
+                  f"{used / nodes:6.0f} bytes/node, load {elapsed * 1000:.0f} ms")
+
+
+def bench_snapshot(dirs: int, files: int):
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as out:
+        for i in range(dirs):
+            d = os.path.join(root, f"d{i}")
+            os.mkdir(d)
+            for k in range(files):
+                open(os.path.join(d, f"file{k}.txt"), "wb").close()
+        image = os.path.join(out, "tree.vfs")
+        print(f"snapshot: {dirs} dirs x {files} files")
+
+        start = time.perf_counter()
+        vfs = Vfs()
+        vfs.init(root)
+        load_tree(vfs)
+        print(f"  scan host tree    {(time.perf_counter() - start) * 1000:7.1f} ms")
+
+        start = time.perf_counter()
+        vfs.save(image)
+        print(f"  save              {(time.perf_counter() - start) * 1000:7.1f} ms, "
+              f"{os.path.getsize(image) / 1024 ** 2:.1f} MB")
+
+        start = time.perf_counter()
+        vfs = Vfs()
+        vfs.load(image)
+        vfs.find(f"/d{dirs - 1}/file{files - 1}.txt")
+        print(f"  load + 1 lookup   {(time.perf_counter() - start) * 1000:7.1f} ms")
+
+        start = time.perf_counter()
+        load_tree(vfs)
+        print(f"  load whole tree   {(time.perf_counter() - start) * 1000:7.1f} ms")
+        vfs.snapshot.close()  # type: ignore
+
+
+def bench_copy(dirs: int, files: int, size: int):
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, "src"))
+        for i in range(dirs):
+            d = os.path.join(root, "src", f"d{i}")
+            os.mkdir(d)
+            for k in range(files):
+                with open(os.path.join(d, f"file{k}.bin"), "wb") as f:
+                    f.write(os.urandom(size))
+        vfs = Vfs()
+        vfs.init(root)
+        src = vfs.get("src")
+        load_tree(vfs)
+        print(f"copy: {dirs} dirs x {files} files x {size} bytes")
+        for name in ("copy1", "copy2"):
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            src.copy_to(vfs.cwd, recursive=True, overwrite_name=name)
+            elapsed = time.perf_counter() - start
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"  cp -r src {name}  {elapsed * 1000:7.1f} ms, +{used / 1024 ** 2:.1f} MB")
+            src = vfs.get(name)
+        vfs.get("copy2/d0/file0.bin").write_bytes(b"changed")
+        print(f"  after one write: copy1/d0/file0.bin is {vfs.get('copy1/d0/file0.bin').size()} bytes")
+
+
+def add_latency(seconds: float):
+    scandir = os.scandir
+
+    def slow_scandir(path):
+        time.sleep(seconds)
+        return scandir(path)
+
+    os.scandir = slow_scandir
+
+
+def bench_list(dirs: int, files: int, workers: int, latency: float):
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(dirs):
+            d = os.path.join(root, f"d{i // 20}", f"d{i}")
+            os.makedirs(d)
+            for k in range(files):
+                open(os.path.join(d, f"file{k}.txt"), "wb").close()
+        print(f"list: {dirs} dirs x {files} files, cold tree as cp -r sees it, "
+              f"{latency:g} ms simulated latency per listing")
+        if latency:
+            add_latency(latency / 1000)
+        for n in (1, workers):
+            vfs = Vfs()
+            vfs.init(root)
+            start = time.perf_counter()
+            load_dirs([vfs.cwd], workers=n)
+            print(f"  {n:2} workers  {(time.perf_counter() - start) * 1000:7.1f} ms")
+
+
+PARSE_LINES = [
+    "history 5",
+    "date -d 2025-09-01 +%F",
+    "head -n 5 -q planets/mars_log.txt",
+    "cp -r -v stars stars_copy",
+    "touch -c -d yesterday dates.txt",
+]
+
+
+def bench_parse(rounds: int):
+    # argument parsing only, as a start script repeating these lines would pay for it
+    import comands  # registers the commands and their option specs
+    from args import Args
+    from console import commands_options
+
+    print(f"parse: {rounds} calls per line, per-call cost")
+    for line in PARSE_LINES:
+        args = Args.parse(line)
+        options = commands_options[args.cmd]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            options.build().parse_args(Args.parse(line).raw)
+        fresh = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            Args(shlex.split(line), options).parse_args()
+        compiled = (time.perf_counter() - start) / rounds
+        print(f"  {line:36} new parser {fresh * 1e6:7.1f} us, compiled {compiled * 1e6:6.1f} us")
+
+
+def bench_history(entries: int, commands: int):
+    from history import History
+
+    lines = [f"echo {i}" for i in range(entries)]
+    # every other command repeats an old one, like Up + Enter does
+    typed = [lines[i * 7 % entries] if i % 2 else f"cd dir{i}" for i in range(commands)]
+    print(f"history: {entries} entries, {commands} commands run, then history -n with {commands} lines")
+
+    old = list(lines)
+    start = time.perf_counter()
+    for line in typed:
+        if line in old:
+            old.remove(line)
+        old.append(line)
+    run_list = time.perf_counter() - start
+    start = time.perf_counter()
+    for line in typed:
+        if line not in old:
+            old.append(line)
+    merge_list = time.perf_counter() - start
+
+    new = History(0)
+    new.extend(lines)
+    start = time.perf_counter()
+    for line in typed:
+        new.append(line)
+    run_index = time.perf_counter() - start
+    start = time.perf_counter()
+    new.extend([line for line in typed if line not in new])
+    merge_index = time.perf_counter() - start
+    start = time.perf_counter()
+    new[-1]
+    up = time.perf_counter() - start
+    assert old == new.lines()
+
+    print(f"  list:  run {run_list * 1000:8.1f} ms, history -n {merge_list * 1000:8.1f} ms")
+    print(f"  index: run {run_index * 1000:8.1f} ms, history -n {merge_index * 1000:8.1f} ms, "
+          f"first Up after a change {up * 1000:.1f} ms")
+
+
+def bench_search(entries: int, queries: int):
+    from history import History
+
+    history = History(0)
+    history.extend(f"cp -r planets/p{i} backup/{i} && ls backup" for i in range(entries))
+    # typing a query letter by letter, each prefix searched as in Ctrl+R; the commands looked
+    # for are spread over the whole history, one query does not match at all
+    words = [f"p{entries * i // queries}" for i in range(queries)] + ["zzz"]
+    print(f"search: {entries} entries, {len(words)} queries typed letter by letter")
+
+    def per_key(search):
+        times = []
+        for word in words:
+            for n in range(1, len(word) + 1):
+                start = time.perf_counter()
+                search(word[:n])
+                times.append(time.perf_counter() - start)
+        return sum(times) / len(times) * 1000, max(times) * 1000
+
+    scan = per_key(lambda query: next((line for line in reversed(history.lines()) if query in line), None))
+    narrowed = per_key(history.search)
+    print(f"  scan:            {scan[0]:8.2f} ms per key, slowest {scan[1]:.2f} ms")
+    print(f"  narrowed blocks: {narrowed[0]:8.2f} ms per key, slowest {narrowed[1]:.2f} ms")
+
+
+def bench_complete(entries: int, presses: int, compact: bool):
+    vfs = Vfs(compact=compact)
+    vfs.init(tempfile.gettempdir())
+    folder = vfs.cwd.add_dir("big")
+    for i in range(entries):
+        folder.add_file(f"file{i:06}.txt")
+    print(f"complete: {entries} files in one folder, Tab pressed {presses} times on 'file0'")
+
+    start = time.perf_counter()
+    for _ in range(presses):
+        sorted(name for name in folder.children.keys() if name.startswith("file0"))
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    folder.complete("file0")
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(presses):
+        folder.complete("file0")
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    folder.complete("file00001")
+    narrow = time.perf_counter() - start
+
+    print(f"  sort per press: {old / presses * 1000:8.2f} ms per press")
+    print(f"  name index:     {indexed / presses * 1000:8.2f} ms per lookup, built in {first * 1000:.1f} ms, "
+          f"'file00001' {narrow * 1000:.2f} ms; in the console only the first press of a Tab cycle looks up")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VFS micro-benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("resolve", help="path resolution on trees of empty directories")
+    p.add_argument("--dirs", type=int, default=2000)
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--rounds", type=int, default=20)
+    p = sub.add_parser("memory", help="memory of a fully loaded tree, object nodes vs --compact-tree")
+    p.add_argument("--dirs", type=int, default=200)
+    p.add_argument("--files", type=int, default=500)
+    p = sub.add_parser("snapshot", help="remount from a saved snapshot vs scanning the host tree")
+    p.add_argument("--dirs", type=int, default=200)
+    p.add_argument("--files", type=int, default=500)
+    p = sub.add_parser("copy", help="cp -r inside the VFS")
+    p.add_argument("--dirs", type=int, default=50)
+    p.add_argument("--files", type=int, default=100)
+    p.add_argument("--size", type=int, default=64 * 1024)
+    p = sub.add_parser("list", help="listing a source tree for cp -r with one thread vs a pool")
+    p.add_argument("--dirs", type=int, default=400)
+    p.add_argument("--files", type=int, default=100)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--latency", type=float, default=2.0, metavar="MS",
+                   help="delay added to every directory listing, as on a network share")
+    p = sub.add_parser("parse", help="command argument parsing, parser per call vs compiled option spec")
+    p.add_argument("--rounds", type=int, default=2000)
+    p = sub.add_parser("history", help="history dedup and history -n, plain list vs indexed history")
+    p.add_argument("--entries", type=int, default=100000)
+    p.add_argument("--commands", type=int, default=2000)
+    p = sub.add_parser("search", help="Ctrl+R history search, scan of the list vs blocks narrowed by the last query")
+    p.add_argument("--entries", type=int, default=300000)
+    p.add_argument("--queries", type=int, default=20)
+    p = sub.add_parser("complete", help="Tab completion in a large folder, sort per press vs sorted name index")
+    p.add_argument("--entries", type=int, default=100000)
+    p.add_argument("--presses", type=int, default=20)
+    p.add_argument("--compact-tree", action="store_true")
+    args = parser.parse_args()
+    if args.bench == "resolve":
+        bench_resolve(args.dirs, args.depth, args.rounds)
+    elif args.bench == "memory":
+        bench_memory(args.dirs, args.files)
+    elif args.bench == "snapshot":
+        bench_snapshot(args.dirs, args.files)
+    elif args.bench == "copy":
+        bench_copy(args.dirs, args.files, args.size)
+    elif args.bench == "list":
+        bench_list(args.dirs, args.files, args.workers, args.latency)
+    elif args.bench == "parse":
+        bench_parse(args.rounds)
+    elif args.bench == "history":
+        bench_history(args.entries, args.commands)
+    elif args.bench == "search":
+        bench_search(args.entries, args.queries)
+    elif args.bench == "complete":
+        bench_complete(args.entries, args.presses, args.compact_tree)
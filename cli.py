@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+
+def parse_size(v: str):
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    v = v.strip().lower().removesuffix("ib").removesuffix("b")
+    if v and v[-1] in units:
+        return int(float(v[:-1]) * units[v[-1]])
+    return int(v)
+
+
+parser = argparse.ArgumentParser(prog="emulator", exit_on_error=False)
+parser.add_argument("vfs", nargs="?", help="path to the physical location of the VFS")
+parser.add_argument("script", nargs="?", help="path to the start script")
+parser.add_argument("--cache-size", type=parse_size, default="64M", metavar="SIZE",
+                    help="memory budget for cached VFS file contents, e.g. 64M")
+parser.add_argument("--compact-tree", action="store_true",
+                    help="keep the VFS tree in compact arrays instead of one object per node")
+parser.add_argument("--writeback", action="store_true",
+                    help="write files changed in the VFS back to the host folder in the background")
+parser.add_argument("--headless", action="store_true",
+                    help="run without a window, writing output to stdout/stderr")
+parser.add_argument("--profile-startup", action="store_true",
+                    help="print an import time breakdown after startup")
+parser.add_argument("--history-file", metavar="PATH",
+                    help="keep the command history in this host file between sessions")
+parser.add_argument("--history-size", type=int, default=10000, metavar="LINES",
+                    help="max commands kept in the history, 0 for unlimited")
+parser.add_argument("--scrollback", type=int, default=10000, metavar="LINES",
+                    help="max lines kept in the console, 0 for unlimited")
+parser.add_argument("--scrollback-bytes", type=int, default=0, metavar="CHARS",
+                    help="max characters kept in the console, 0 for unlimited")
+
+options, _ = parser.parse_known_args(sys.argv[1:])
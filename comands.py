@@ -1,8 +1,13 @@
+from collections import deque
+from contextlib import closing
 from datetime import datetime, timezone
+from itertools import islice
 
-import dateparser
-
-from console import Args, Tags, clear_console, command, console_size, get_console_history, has_input, input, pause, print, print_err, vfs
+import jobs
+import pipeline
+from args import Arg, Group, Options
+from console import Args, Tags, clear_console, command, count_job, console_size, get_console_history, has_input, input, pause, print, print_err, report_job, vfs, write_job_output
+from vfs import CopyStats, load_dirs
 
 
 @command(alias="dir")
@@ -29,7 +34,7 @@ def ls(args: Args):
         if not item.is_dir:
             print(f"{path}: Not a directory")
             return
-    for name in item.children.keys():
+    for name in list(item.children):
         print(name)
 
 
@@ -60,17 +65,26 @@ def cat(args: Args):
     """
     Usage: cat [FILE]...
     Concatenate FILE(s) to standard output.
+    With no FILE, or when FILE is -, read the output of the previous command
+      > ls | cat
     """
-    if len(args) == 0:
+    source = pipeline.stdin()
+    if len(args) == 0 and source is None:
         print("specify file")
         return
-    for fname in args:
+    for fname in args or ["-"]:
+        if fname == "-" and source is not None:
+            for text in source.iter_text():
+                print(text, end="")
+            continue
         file = vfs.find(fname)
         if not file:
             print(f"cannot open '{fname}' for reading: No such file or directory")
             continue
         try:
-            print(file.read())
+            for text in file.iter_text():
+                print(text, end="")
+            print()
         except Exception as x:
             print(f"cannot open '{fname}' for reading: {x}")
 
@@ -115,6 +129,152 @@ def stat(args: Args):
 
 
 @command()
+def vfsstat(args: Args):
+    """
+    Usage: vfsstat
+    Display VFS file content cache statistics.
+    """
+    cache = vfs.cache
+    with cache.lock:
+        lookups = cache.hits + cache.misses
+        ratio = cache.hits / lookups * 100 if lookups else 0
+        print(f"Budget:    {cache.budget} bytes")
+        print(f"Clean:     {len(cache.clean)} files, {cache.clean_bytes} bytes")
+        print(f"Dirty:     {len(cache.dirty)} files, {cache.dirty_bytes} bytes in {len(cache.shared)} buffers (pinned)")
+        print(f"Hits:      {cache.hits} ({ratio:.1f}%)")
+        print(f"Misses:    {cache.misses}")
+        print(f"Evictions: {cache.evictions}")
+    writeback = vfs.writeback
+    if writeback:
+        with writeback.lock:
+            print(f"Writeback: {len(writeback.dirty)} pending, {writeback.writes} written in {writeback.batches} batches")
+
+
+@command()
+def sync(args: Args):
+    """
+    Usage: sync
+    Write all changes queued by --writeback to the host folder and wait
+    until they are on disk.
+    """
+    for error in vfs.sync():
+        print(f"sync: {error}")
+
+
+@command()
+def rescan(args: Args):
+    """
+    Usage: rescan [DIRECTORY]...
+    Forget cached directory listings so they are re-read from the host
+    on next access. Without arguments the whole VFS is rescanned.
+    Files and directories created inside the VFS are kept.
+    """
+    if len(args) == 0:
+        vfs.invalidate()
+        return
+    for path in args:
+        item = vfs.find(path)
+        if not item:
+            print(f"{path}: No such file or directory")
+        elif not item.is_dir:
+            print(f"{path}: Not a directory")
+        else:
+            item.invalidate(recursive=True)
+
+
+@command(options=Options(
+    Arg("file"),
+    Arg("-a", "--all", action="store_true"),
+))
+def save(args: Args):
+    """
+    Usage: save [-a] FILE
+    Save the VFS tree and all changes made inside it to the snapshot FILE
+    on the host. Start the emulator with FILE instead of a folder to load it.
+
+      -a, --all     read every directory from the host first, so the
+                    snapshot holds the whole tree
+    """
+    argv = args.parse_args()
+    vfs.save(argv.file, full=argv.all)
+
+
+@command(options=Options(Arg("file")))
+def load(args: Args):
+    """
+    Usage: load FILE
+    Replace the VFS with the snapshot FILE written by save.
+    """
+    argv = args.parse_args()
+    vfs.load(argv.file)
+
+
+@command("jobs")
+def cmd_jobs(args: Args):
+    """
+    Usage: jobs
+    List background jobs started with a trailing &
+      > cp -r big copy &
+    """
+    for job in jobs.all_jobs():
+        print(job)
+
+
+@command()
+def fg(args: Args):
+    """
+    Usage: fg [%N]
+    Bring job N (the most recent one by default) to the foreground: print
+    the output it buffered so far and wait for it. Ctrl+C cancels the job.
+    """
+    if len(args) > 1:
+        print("too many arguments")
+        return
+    job = jobs.get(args[0] if args else None)
+    print(job.line)
+    job.attach(write_job_output)
+    try:
+        while not job.done.wait(0.1):
+            jobs.check_cancel()
+    except jobs.Cancelled:
+        job.cancel()
+        job.done.wait()
+        raise
+    finally:
+        if job.done.is_set():
+            jobs.forget(job)
+    if job.status != jobs.DONE:
+        print(job)
+    count_job(job)
+
+
+@command()
+def wait(args: Args):
+    """
+    Usage: wait [%N]...
+    Wait for the given jobs (all of them by default) to finish and print
+    their output. Ctrl+C stops waiting, the jobs keep running.
+    """
+    targets = [jobs.get(spec) for spec in args] if len(args) else jobs.all_jobs()
+    for job in targets:
+        while not job.done.wait(0.1):
+            jobs.check_cancel()
+        jobs.forget(job)
+        report_job(job)
+
+
+@command(options=Options(
+    Arg("N", nargs="?", default=-1, type=int),
+    Group(
+        Arg("-c", action="store_true", required=False),
+        Arg("-d", required=False, type=int),
+        Arg("-a", required=False),
+        Arg("-n", required=False),
+        Arg("-r", required=False),
+        Arg("-w", required=False),
+        Arg("-s", nargs="+", required=False),
+    ),
+))
 def history(args: Args):
     """
     history: history [-c] [-d offset] [n]
@@ -139,15 +299,6 @@ def history(args: Args):
 
       -s        append the ARGs to the history list as a single entry
     """
-    args.add_argument("N", nargs="?", default=-1, type=int)
-    g = args.add_mutually_exclusive_group()
-    g.add_argument("-c", action="store_true", required=False)
-    g.add_argument("-d", required=False, type=int)
-    g.add_argument("-a", required=False)
-    g.add_argument("-n", required=False)
-    g.add_argument("-r", required=False)
-    g.add_argument("-w", required=False)
-    g.add_argument("-s", nargs="+", required=False)
     argv = args.parse_args()
     history = get_console_history()
     if argv.c:
@@ -157,8 +308,7 @@ def history(args: Args):
         history.pop(argv.d)
         return
     if argv.s:
-        for v in argv.s:
-            history.append(v)
+        history.extend(argv.s)
         return
     fname = argv.a or argv.n or argv.r
     if fname:
@@ -170,32 +320,42 @@ def history(args: Args):
             print(f"{fname}: Not a file")
             return
     if argv.a:
-        for line in history:
-            item.write(line + "\n", append=True)
+        item.write("".join(line + "\n" for line in history), append=True)
         return
     if argv.n:
-        for line in item.read_lines():
-            if line not in history:
-                history.append(line)
+        history.extend([line for line in item.iter_lines() if line not in history])
         return
     if argv.r:
-        for line in item.read_lines():
-            history.append(line)
+        history.extend(item.iter_lines())
         return
     if argv.w:
         item = vfs.create_file(argv.w)
         item.write("\n".join(history))
         return
 
-    c = len(history) if argv.N < 0 else argv.N
-    ml = len(str(len(history))) + 1
-    for i, v in enumerate(history):
-        if i >= len(history) - c:
-            print(f"%{ml}d  " % i, end="", tags=Tags.blue)
-            print(v)
-
-
-@command()
+    lines = history.lines()
+    c = len(lines) if argv.N < 0 else argv.N
+    ml = len(str(len(lines))) + 1
+    for i in range(max(len(lines) - c, 0), len(lines)):
+        print(f"%{ml}d  " % i, end="", tags=Tags.blue)
+        print(lines[i])
+
+
+@command(options=Options(
+    Arg("FORMAT", default="%c", nargs="?"),
+    Group(
+        Arg("-I", "--iso-8601", required=False, nargs="?", const="date",
+            choices=["date", "d", "hours", "h", "minutes", "m", "seconds", "s", "ns", "n"]),
+        Arg("-R", "--rfc-email", required=False, action="store_true"),
+        Arg("--rfc-3339", required=False, choices=["date", "d", "seconds", "s", "ns", "n", ]),
+        Arg("-u", "--utc", "--universal", required=False, action="store_true"),
+    ),
+    Group(
+        Arg("-d", "--date"),
+        Arg("-f", "--file"),
+        Arg("-r", "--reference"),
+    ),
+))
 def date(args: Args):
     """
     Usage: date [OPTION]... [+FORMAT]
@@ -203,7 +363,8 @@ def date(args: Args):
 
     Mandatory arguments to long options are mandatory for short options too.
       -d, --date=STRING          display time described by STRING, not 'now'
-      -f, --file=DATEFILE        like --date; once for each line of DATEFILE
+      -f, --file=DATEFILE        like --date; once for each line of DATEFILE;
+                                  with DATEFILE -, read the output of the previous command
       -I[FMT], --iso-8601[=FMT]  output date/time in ISO 8601 format.
                                   FMT='date' for date only (the default),
                                   'hours', 'minutes', 'seconds', or 'ns'
@@ -264,17 +425,6 @@ def date(args: Args):
     Show relative date
       > date --date='in 2 days'
     """
-    args.add_argument("FORMAT", default="%c", nargs="?")
-    g1 = args.add_mutually_exclusive_group()
-    g1.add_argument("-I", "--iso-8601", required=False, nargs="?", const="date",
-                    choices=["date", "d", "hours", "h", "minutes", "m", "seconds", "s", "ns", "n"])
-    g1.add_argument("-R", "--rfc-email", required=False, action="store_true")
-    g1.add_argument("--rfc-3339", required=False, choices=["date", "d", "seconds", "s", "ns", "n", ])
-    g1.add_argument("-u", "--utc", "--universal", required=False, action="store_true")
-    g2 = args.add_mutually_exclusive_group()
-    g2.add_argument("-d", "--date")
-    g2.add_argument("-f", "--file")
-    g2.add_argument("-r", "--reference")
     argv = args.parse_args()
 
     tz = datetime.now(timezone.utc).astimezone().tzinfo
@@ -307,6 +457,7 @@ def date(args: Args):
         if isinstance(datev, datetime):
             date = datev.replace(tzinfo=tz)
         elif datev:
+            import dateparser
             d = datev[1:] if datev.startswith("@") else datev
             date = dateparser.parse(d)
             if not date:
@@ -320,11 +471,28 @@ def date(args: Args):
         return date.strftime(fmt)
 
     if argv.file:
-        content = vfs.get(argv.file).read()
-        if not content:
-            return
-        for line in content.strip().split("\n"):
-            print(conver_date(line.strip()))
+        source = pipeline.stdin()
+        if argv.file == "-" and source is not None:
+            lines = source.iter_lines()
+        else:
+            item = vfs.get(argv.file)
+            if item.size() == 0:
+                return
+            lines = item.iter_lines()
+        seen = False
+        blank = 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                blank += seen
+                continue
+            for _ in range(blank):
+                print(conver_date(""))
+            blank = 0
+            seen = True
+            print(conver_date(line))
+        if not seen:
+            print(conver_date(""))
     elif argv.reference:
         file = vfs.cwd.follow_path(argv.reference)
         if not file:
@@ -336,12 +504,24 @@ def date(args: Args):
         print(conver_date(argv.date))
 
 
-@command()
+@command(options=Options(
+    Arg("FILE", nargs="*"),
+    Group(
+        Arg("-c", "--bytes", required=False),
+        Arg("-n", "--lines", required=False),
+    ),
+    Group(
+        Arg("-q", "--quiet", "--silent", action="store_true", required=False),
+        Arg("-v", "--verbose", action="store_true", required=False),
+    ),
+))
 def head(args: Args):
     """
     Usage: head [OPTION]... [FILE]...
     Print the first 10 lines of each FILE to standard output.
     With more than one FILE, precede each with a header giving the file name.
+    With no FILE, or when FILE is -, read the output of the previous command
+      > cat big.log | head -n 5
 
     Mandatory arguments to long options are mandatory for short options too.
       -c, --bytes=[-]NUM       print the first NUM bytes of each file;
@@ -358,13 +538,6 @@ def head(args: Args):
     GB 1000*1000*1000, G 1024*1024*1024, and so on for T, P, E, Z, Y, R, Q.
     Binary prefixes can be used, too: KiB=K, MiB=M, and so on.
     """
-    args.add_argument("FILE", nargs="+")
-    g1 = args.add_mutually_exclusive_group()
-    g1.add_argument("-c", "--bytes", required=False)
-    g1.add_argument("-n", "--lines", required=False)
-    g2 = args.add_mutually_exclusive_group()
-    g2.add_argument("-q", "--quiet", "--silent", action="store_true", required=False)
-    g2.add_argument("-v", "--verbose", action="store_true", required=False)
     argv = args.parse_args()
 
     def parse_count(v: str, msg: str):
@@ -401,7 +574,12 @@ def head(args: Args):
         Count = parse_count(argv.lines, f"invalid number of lines: {argv.lines}") if argv.lines else 10
     else:
         Count = parse_count(argv.bytes, f"invalid number of bytes: {argv.bytes}")
+    source = pipeline.stdin()
     files: list[str] = argv.FILE
+    if not files:
+        if source is None:
+            raise Exception("the following arguments are required: FILE")
+        files = ["-"]
     for i, fname in enumerate(files):
         if i > 0:
             print()
@@ -411,6 +589,9 @@ def head(args: Args):
             print("==> ", end="", tags=Tags.blue)
             print(fname, end="", tags=Tags.green)
             print(" <==", tags=Tags.blue)
+        if fname == "-" and source is not None:
+            head_stdin(source, Count, bool(argv.bytes))
+            continue
         item = vfs.cwd.follow_path(fname)
         if not item:
             print(f"{fname}: No such file or directory")
@@ -421,16 +602,55 @@ def head(args: Args):
         try:
             count = Count
             if not argv.bytes:
-                for line in item.read_lines()[:count]:
-                    print(line)
+                with closing(item.iter_mapped_lines()) as lines:
+                    if count >= 0:
+                        for line in islice(lines, count):
+                            print(line)
+                    else:
+                        tail: deque[str] = deque()
+                        for line in lines:
+                            tail.append(line)
+                            if len(tail) > -count:
+                                print(tail.popleft())
             else:
-                f = item.read_bytes()
-                print(str(f[:count])[2:-1])
+                with item.mapped() as buf:
+                    print(str(bytes(buf[:count]))[2:-1])
         except Exception as x:
             print(f"cannot open '{fname}' for reading: {x}")
 
 
-@command()
+def head_stdin(source: pipeline.Pipe, count: int, as_bytes: bool):
+    # returning early closes the pipe, which stops the command writing into it
+    if as_bytes:
+        data = bytearray()
+        for text in source.iter_text():
+            data += text.encode("utf8")
+            if 0 <= count <= len(data):
+                break
+        print(str(bytes(data[:count]))[2:-1])
+    elif count >= 0:
+        for line in islice(source.iter_lines(), count):
+            print(line)
+    else:
+        tail: deque[str] = deque()
+        for line in source.iter_lines():
+            tail.append(line)
+            if len(tail) > -count:
+                print(tail.popleft())
+
+
+@command(options=Options(
+    Arg("sources", nargs="+"),
+    Group(
+        Arg("-i", "--interactive", action="store_true"),
+        Arg("-n", "--no-clobber", action="store_true"),
+    ),
+    Arg("-r", "-R", "--recursive", action="store_true"),
+    Arg("--stats", action="store_true"),
+    Arg("-t", "--target-directory"),
+    Arg("-T", "--no-target-directory", action="store_true"),
+    Arg("-v", "--verbose", action="store_true"),
+))
 def cp(args: Args):
     """
     Usage: cp [OPTION]... [-T] SOURCE DEST
@@ -445,17 +665,9 @@ def cp(args: Args):
       -t, --target-directory=DIRECTORY  copy all SOURCE arguments into DIRECTORY
       -T, --no-target-directory    treat DEST as a normal file
       -v, --verbose                explain what is being done
+          --stats                  print the number of copied files and the copy speed
           --help        display this help and exit
     """
-    args.add_argument("sources", nargs="+")
-    g = args.add_mutually_exclusive_group()
-    g.add_argument("-i", "--interactive", action="store_true")
-    g.add_argument("-n", "--no-clobber", action="store_true")
-    args.add_argument("-r", "-R", "--recursive", action="store_true")
-    args.add_argument("-t", "--target-directory")
-    args.add_argument("-T", "--no-target-directory", action="store_true")
-    args.add_argument("-v", "--verbose", action="store_true")
-
     argv = args.parse_args()
 
     dest = None
@@ -469,6 +681,7 @@ def cp(args: Args):
         return
 
     dest_item = vfs.find(dest)
+    stats = CopyStats() if argv.stats else None
 
     def do_copy(src: str, dest_path: str):
         src = src.replace("\\", "/")
@@ -479,15 +692,18 @@ def cp(args: Args):
             return
 
         trailing_slash = src.endswith("/") and src_item.is_dir
+        if argv.recursive:
+            # list the source tree in parallel first, the copy itself then runs in order
+            load_dirs([src_item])
 
         if dest_item and dest_item.is_dir and not argv.no_target_directory:
             if src_item.is_file or not trailing_slash:
                 src_item.copy_to(dest_item, recursive=argv.recursive, overwrite=not argv.no_clobber,
-                                 interactive=argv.interactive, verbose=argv.verbose)
+                                 interactive=argv.interactive, verbose=argv.verbose, stats=stats)
             else:
                 for child in src_item.listdir():
                     child.copy_to(dest_item, recursive=argv.recursive, overwrite=not argv.no_clobber,
-                                  interactive=argv.interactive, verbose=argv.verbose)
+                                  interactive=argv.interactive, verbose=argv.verbose, stats=stats)
         else:
             *dest_parent_path, new_name = dest_path.split("/")
             dest_parent_path = "/".join(dest_parent_path) or "."
@@ -500,7 +716,8 @@ def cp(args: Args):
                 print(f"cp: -r not specified; omitting directory '{src}'")
                 return
             src_item.copy_to(dest_parent, overwrite_name=new_name, recursive=argv.recursive,
-                             overwrite=not argv.no_clobber, interactive=argv.interactive, verbose=argv.verbose)
+                             overwrite=not argv.no_clobber, interactive=argv.interactive, verbose=argv.verbose,
+                             stats=stats)
 
     if len(argv.sources) > 1:
         if not dest_item or dest_item.is_file or argv.no_target_directory:
@@ -510,9 +727,24 @@ def cp(args: Args):
             do_copy(src, dest)
     else:
         do_copy(argv.sources[0], dest)
-
-
-@command()
+    if stats:
+        print(f"cp: {stats}")
+
+
+@command(options=Options(
+    Arg("files", nargs="+"),
+    Group(
+        Arg("-a", action="store_true"),
+        Arg("-m", action="store_true"),
+        Arg("--time", choices=["access", "atime", "use", "modify", "mtime"]),
+    ),
+    Group(
+        Arg("-d", "--date", default=None),
+        Arg("-r", "--reference", default=None),
+        Arg("-t", default=None),
+    ),
+    Arg("-c", "--no-create", action="store_true"),
+))
 def touch(args: Args):
     """
     Usage: touch [OPTION]... FILE...
@@ -535,17 +767,6 @@ def touch(args: Args):
 
     Note that the -d and -t options accept different time-date formats.
     """
-    args.add_argument("files", nargs="+")
-    g1 = args.add_mutually_exclusive_group()
-    g1.add_argument("-a", action="store_true")
-    g1.add_argument("-m", action="store_true")
-    g1.add_argument("--time", choices=["access", "atime", "use", "modify", "mtime"])
-    g2 = args.add_mutually_exclusive_group()
-    g2.add_argument("-d", "--date", default=None)
-    g2.add_argument("-r", "--reference", default=None)
-    g2.add_argument("-t", default=None)
-    args.add_argument("-c", "--no-create", action="store_true")
-
     argv = args.parse_args()
 
     now = datetime.now()
@@ -558,6 +779,7 @@ def touch(args: Args):
         now = ref_item.get_mod_date()
 
     elif argv.date:
+        import dateparser
         now = dateparser.parse(argv.date)
         if not now:
             print(f"touch: invalid date string '{argv.date}'")
@@ -1,348 +1,21 @@
+import importlib
 import os
-import platform
-import re
-import sys
+import shlex
 import threading
-import tkinter as tk
-import tkinter.font as tkFont
+from collections import deque
+from types import ModuleType
 from typing import Callable
-import unicodedata
 
-import pyperclip
-
-from args import Args
-from vfs import VMODE, Vfs
+import jobs
+import pipeline
+from args import Args, Options
+from cli import options
+from history import History
+from vfs import Vfs
 
 stdinput = input
 stdprint = print
 
-username = os.getlogin()
-hostname = platform.node()
-
-folder = "data"
-try:
-    folder = os.path.join(sys._MEIPASS, folder)  # type: ignore
-except Exception:
-    pass
-
-
-def is_windows_11():
-    if sys.platform == "win32":
-        return sys.getwindowsversion().build >= 22000
-    return False
-
-
-def dark_title_bar():
-    if not is_windows_11():
-        return
-    import ctypes as ct
-    window.update()
-    DWMWA_USE_IMMERSIVE_DARK_MODE = 20
-    set_window_attribute = ct.windll.dwmapi.DwmSetWindowAttribute
-    get_parent = ct.windll.user32.GetParent
-    hwnd = get_parent(window.winfo_id())
-    rendering_policy = DWMWA_USE_IMMERSIVE_DARK_MODE
-    value = 2
-    value = ct.c_int(value)
-    set_window_attribute(hwnd, rendering_policy, ct.byref(value), ct.sizeof(value))
-
-
-window = tk.Tk()
-window.title(f"Emulator - {username}@{hostname}")
-window.iconbitmap(os.path.join(folder, "favicon.ico"))
-window.config(bg="#0c0c0c")
-w, h = 900, 500
-x = (window.winfo_screenwidth() - w) // 2
-y = (window.winfo_screenheight() - h) // 2
-window.geometry(f"{w}x{h}+{x}+{y}")
-try:
-    dark_title_bar()
-except Exception:
-    pass
-
-event = threading.Event()
-event_anykey = threading.Event()
-event_anykey_toset = False
-event_anykey.set()
-lock = threading.Lock()
-
-console_text = ""
-console_tags: list[tuple[int, int, str]] = []
-input_buffer = ""
-input_file = ""
-
-
-def on_text_change(e):
-    global console_text, input_buffer
-    if text.edit_modified():
-        if lock.locked():
-            text.edit_modified(False)
-            return
-        with lock:
-            new_text = text.get("1.0", tk.END)[:-1]
-            changed_text = new_text[:len(console_text)]
-            to_end = False
-            if console_text == changed_text:
-                input_buffer = new_text[len(console_text):]
-            else:
-                old_text = console_text + input_buffer
-                oldl = len(old_text)
-                newl = len(new_text)
-                si, ei = 0, 1
-                while si < oldl and si < newl and old_text[si] == new_text[si]:
-                    si += 1
-                while oldl - ei > 0 and newl - ei > 0 and old_text[oldl - ei] == new_text[newl - ei]:
-                    ei += 1
-                input_buffer = new_text[si:newl - ei + 1]
-                to_end = True
-            if "\n" in input_buffer:
-                event.set()
-            update_console_text()
-            if to_end:
-                text.mark_set("insert", "end")
-            text.edit_modified(False)
-
-
-def update_console_text():
-    pos = text.index(tk.INSERT)
-    nl = "\n" if input_buffer.endswith("\n") else ""
-    inp = input_buffer.split("\n")[0] + nl if not event.is_set() else ""
-    text.replace("1.0", tk.END, console_text + inp)
-    text.see(tk.END)
-    text.mark_set("insert", pos)
-    for (s, e, tag) in console_tags:
-        text.tag_add(tag, f"1.0+{s} chars", f"1.0+{e} chars")
-
-
-def on_key_release(event):
-    global history_i, input_buffer, autocomplete_moveto, ctrl_backspace_moveto, event_anykey_toset
-    if event.state & 0x4 and event.keysym == "w":
-        window.destroy()
-        return
-    if not event_anykey.is_set():
-        if event_anykey_toset:
-            event_anykey_toset = False
-            event_anykey.set()
-        return
-    if event.keysym == "Return":
-        with lock:
-            input_buffer += "\n"
-            update_console_text()
-    elif event.keysym in ("Up", "Down"):
-        pos = get_cursor_input_char_position()
-        if pos < 0:
-            return
-        if not history_enabled:
-            text.mark_set("insert", "end")
-            return
-        if event.keysym == "Up":
-            history_i -= 1
-        else:
-            history_i += 1
-        history_i = max(min(history_i, len(history) - 1), 0)
-        if len(history) > 0:
-            with lock:
-                input_buffer = history[history_i]
-                update_console_text()
-        text.mark_set("insert", "end")
-    elif event.state & 0x4 and event.keysym == "Left":
-        pos = get_cursor_input_char_position()
-        if pos < 0:
-            if "\n" not in console_text[pos:]:
-                text.mark_set("insert", f"1.0+{len(console_text)} chars")
-    elif event.keysym == "Escape":
-        with lock:
-            history_i = len(history)
-            input_buffer = ""
-            update_console_text()
-        text.mark_set("insert", "end")
-    elif event.keysym == "Tab":
-        if autocomplete_moveto >= 0:
-            text.mark_set("insert", f"1.0+{len(console_text) + autocomplete_moveto} chars")
-            autocomplete_moveto = -1
-    elif event.state & 0x4 and event.keysym == "BackSpace":
-        if ctrl_backspace_moveto >= 0:
-            text.mark_set("insert", f"1.0+{len(console_text) + ctrl_backspace_moveto} chars")
-            ctrl_backspace_moveto = -1
-    elif event.keysym == "Home":
-        pos = get_cursor_input_char_position()
-        if pos >= 0:
-            text.mark_set("insert", f"1.0+{len(console_text)} chars")
-
-
-def on_key_press(event):
-    global autocomplete, autocomplete_start, autocomplete_i, input_buffer, autocomplete_moveto, event_anykey_toset
-    if not event_anykey.is_set():
-        event_anykey_toset = True
-        return "break"
-    if event.keysym != "Tab":
-        autocomplete = None
-    if event.keysym == "Return":
-        return "break"
-    if event.keysym in ("Up", "Down", "Home"):
-        pos = get_cursor_input_char_position()
-        if pos >= 0:
-            return "break"
-        return
-    if event.keysym in ("Left", "BackSpace"):
-        pos = get_cursor_input_char_position()
-        if pos == 0:
-            return "break"
-        return
-    if not autocomplete_enabled:
-        return
-    if event.keysym != "Tab":
-        return
-    cpos = get_cursor_input_char_position()
-    if cpos < 0:
-        return "break"
-    if autocomplete is None:
-        autocomplete = ""
-        quote = False
-        quoteI = 0
-        for i in range(min(cpos - 1, len(input_buffer))):
-            if input_buffer[i] == '"':
-                quoteI = i
-                quote = not quote
-        if quote:
-            autocomplete = input_buffer[quoteI:cpos]
-            autocomplete_start = quoteI
-        else:
-            i = cpos - 1
-            while i >= 0 and i < len(input_buffer) and input_buffer[i] != " ":
-                autocomplete += input_buffer[i]
-                i -= 1
-            autocomplete_start = i + 1
-            autocomplete = autocomplete[::-1]
-        autocomplete_i = -1
-        autocomplete = autocomplete.replace("\\", "/")
-    startswith = autocomplete.strip('"')
-    prefix = ""
-    item = vfs.cwd
-    if "/" in autocomplete:
-        sw = startswith
-        *path, startswith = startswith.split("/")
-        sep = "/" if VMODE else os.path.sep
-        prefix = sep.join(path) + sep
-        if sw.startswith("/"):
-            path[0] = "/"
-        try:
-            item = item.follow_path(path)
-        except Exception as x:
-            print(x)
-            return "break"
-        if not item:
-            return "break"
-    try:
-        items = sorted(it for it in item.children.keys() if it.startswith(startswith))
-    except Exception as x:
-        print(x)
-        return "break"
-    if len(items) == 0:
-        return "break"
-    autocomplete_i = (autocomplete_i + 1) % len(items)
-    item = prefix + items[autocomplete_i]
-    if " " in item:
-        if not autocomplete.startswith('"'):
-            autocomplete = '"' + autocomplete
-        item = f'"{item}"'
-    with lock:
-        end = cpos
-        if cpos < len(input_buffer) and input_buffer[cpos] == '"':
-            end += 1
-        input_buffer = input_buffer[:autocomplete_start] + item + input_buffer[end:]
-        autocomplete_moveto = autocomplete_start + len(item)
-        if len(item) > 0 and item[-1] == '"':
-            autocomplete_moveto -= 1
-        update_console_text()
-    return "break"
-
-
-def get_cursor_char_position():
-    insert_index = text.index(tk.INSERT)
-    char_position = text.count("1.0", insert_index, "chars")
-    if char_position:
-        return char_position[0]
-    return 0
-
-
-def get_cursor_input_char_position():
-    add = sum(1 for ch in console_text if unicodedata.east_asian_width(ch) == "W")
-    console_text_len = len(console_text) + add
-    return get_cursor_char_position() - console_text_len
-
-
-ctrl_backspace_moveto = -1
-ctrl_backspace_chars = (" ", "_", "/", "\\")
-
-
-def ctrl_backspace(event):
-    global input_buffer, ctrl_backspace_moveto
-    pos = get_cursor_input_char_position()
-    if pos < 0:
-        return "break"
-    start = pos - 1
-    sp = start >= 0 and start < len(input_buffer) and input_buffer[start] in ctrl_backspace_chars
-    spch = input_buffer[start] if sp else ""
-    while start >= 0 and start < len(input_buffer) and (
-            (sp and input_buffer[start] == spch) or (not sp and input_buffer[start] not in ctrl_backspace_chars)):
-        start -= 1
-    start += 1
-    with lock:
-        input_buffer = input_buffer[:start] + input_buffer[pos:]
-        update_console_text()
-        ctrl_backspace_moveto = start
-    return "break"
-
-
-def ctrl_delete(event):
-    global input_buffer, ctrl_backspace_moveto
-    pos = get_cursor_input_char_position()
-    if pos < 0:
-        return "break"
-    end = pos
-    sp = end < len(input_buffer) and input_buffer[end] in ctrl_backspace_chars
-    spch = input_buffer[end] if sp else ""
-    while end < len(input_buffer) and (
-            (sp and input_buffer[end] == spch) or (not sp and input_buffer[end] not in ctrl_backspace_chars)):
-        end += 1
-    with lock:
-        input_buffer = input_buffer[:pos] + input_buffer[end:]
-        update_console_text()
-    return "break"
-
-
-def on_right_click(e):
-    sel_start, sel_end = text.tag_ranges("sel")
-    if sel_start and sel_end:
-        selected_text = text.get(sel_start, sel_end)
-        pyperclip.copy(selected_text)
-        text.tag_remove("sel", "1.0", tk.END)
-
-
-font = tkFont.Font(family="Consolas", size=11)
-char_width = font.measure("0")
-char_height = font.metrics()["linespace"]
-text = tk.Text(window,
-               bg="#0c0c0c",
-               fg="#f3f3f3",
-               insertbackground="#f3f3f3",
-               selectbackground="#f3f3f3",
-               selectforeground="#0c0c0c",
-               font=font,
-               )
-text.bind("<<Modified>>", on_text_change)
-text.bind("<KeyRelease>", on_key_release)
-text.bind('<KeyPress>', on_key_press)
-text.bind("<Control-BackSpace>", ctrl_backspace)
-text.bind("<Control-Delete>", ctrl_delete)
-text.bind("<Button-3>", on_right_click)
-text.pack(expand=True, fill="both")
-
-text.tag_config("red", foreground="#ff0000")
-text.tag_config("green", foreground="#00ff00")
-text.tag_config("blue", foreground="#1d58ff")
-
 
 class Tags:
     red = "red"
@@ -350,66 +23,77 @@ class Tags:
     blue = "blue"
 
 
+backend: ModuleType
+
+
 def input(prompt: str = "", tags: str | list[str] | None = None) -> str:
-    global console_text, input_buffer
-    print(prompt, end="", tags=tags)
-    if "\n" not in input_buffer:
-        text.mark_set("insert", "end")
-        event.clear()
-        with lock:
-            update_console_text()
-        event.wait()
-    with lock:
-        i = input_buffer.index("\n")
-        r = input_buffer[:i]
-        console_text += r + "\n"
-        input_buffer = input_buffer[i + 1:]
-        update_console_text()
-    return r
+    job = jobs.current()
+    if job is not None and not job.attached:
+        raise Exception("cannot read input in a background job, bring it to the foreground with fg")
+    if isinstance(pipeline.stdout(), pipeline.Pipe):
+        raise Exception("cannot read input in the middle of a pipeline")
+    if tags:
+        tags = [tags] if isinstance(tags, str) else tags
+    if script:
+        # a command run by the start script reads the lines that follow it, as typed input would be
+        line, _ = script.popleft()
+        print(prompt, end="", tags=tags)
+        print(line)
+        return line
+    return backend.input(prompt, tags)
 
 
 def has_input():
-    return "\n" in input_buffer
+    return backend.has_input()
 
 
 def print(*values: object, sep: str = " ", end: str = "\n", tags: str | list[str] | None = None):
-    global console_text
-    with lock:
-        l = len(console_text)
-        console_text += sep.join(map(str, values)) + end
-        if tags:
-            tags = [tags] if isinstance(tags, str) else tags
-            for tag in tags:
-                console_tags.append((l, len(console_text), tag))
-        update_console_text()
+    jobs.check_cancel()
+    if tags:
+        tags = [tags] if isinstance(tags, str) else tags
+    text = sep.join(map(str, values)) + end
+    out = pipeline.stdout()
+    if out is not None:
+        out.write(text)
+        return
+    job = jobs.current()
+    if job is None or not job.buffer(text, tags, False):
+        backend.write(text, tags)
+
+
+def flush():
+    backend.flush()
 
 
 def print_err(*values: object, sep: str = " ", end: str = "\n", tags: str | list[str] | None = None):
+    jobs.check_cancel()
     if not tags:
         tags = []
     tags = [tags] if isinstance(tags, str) else tags
     tags.append(Tags.red)
-    print(*values, sep=sep, end=end, tags=tags)
+    text = sep.join(map(str, values)) + end
+    job = jobs.current()
+    if job is None or not job.buffer(text, tags, True):
+        backend.write_err(text, tags)
+
+
+def write_job_output(text: str, tags: list[str] | None, err: bool):
+    if err:
+        backend.write_err(text, tags)
+    else:
+        backend.write(text, tags)
 
 
 def console_size():
-    return text.winfo_width() // char_width - 1, text.winfo_height() // (char_height + 1)
+    return backend.size()
 
 
 def clear_console(new_text: str = ""):
-    global console_text, console_tags
-    with lock:
-        console_text = new_text
-        console_tags = []
-        update_console_text()
+    backend.clear(new_text)
 
 
 def to_new_line():
-    global console_text
-    with lock:
-        if not console_text.endswith("\n"):
-            console_text += "\n"
-        update_console_text()
+    backend.new_line()
 
 
 def get_console_history():
@@ -417,35 +101,35 @@ def get_console_history():
 
 
 def pause():
-    event_anykey.clear()
-    event_anykey.wait()
+    backend.pause()
 
 
 def run():
-    t = threading.Thread(target=run_cmd)
-    t.daemon = True
-    t.start()
-    text.focus_set()
-    window.mainloop()
-    sys.exit()
+    global backend
+    if options.headless:
+        import headless
+        backend = headless
+    else:
+        import gui
+        backend = gui
+    backend.run(run_cmd)
 
 
 commands: dict[str, Callable[[Args], None]] = {}
 commands_help: dict[str, str | None] = {}
 commands_aliases: dict[str, list[str]] = {}
-history: list[str] = []
-history_i = 0
-history_enabled = False
-autocomplete: str | None = None
-autocomplete_enabled = False
-autocomplete_i = -1
-autocomplete_start = 0
-autocomplete_moveto = -1
+commands_options: dict[str, Options] = {}
+lazy_commands: dict[str, str] = {}
+history = History(options.history_size, options.history_file)
+failed_jobs = 0
+# start script lines not run yet, compiled up front
+script: "deque[tuple[str, Compiled | Exception | None]]" = deque()
 
-vfs = Vfs()
+vfs = Vfs(options.cache_size, compact=options.compact_tree)
 
 
-def command(name: str | None = None, *, alias: str | tuple[str] | None = None, doc: str | None = None):
+def command(name: str | None = None, *, alias: str | tuple[str] | None = None, doc: str | None = None,
+            options: Options | None = None):
     aliases: list[str] = []
     if alias:
         if isinstance(alias, str):
@@ -464,102 +148,284 @@ def command(name: str | None = None, *, alias: str | tuple[str] | None = None, d
             commands[cname] = fn
             commands_help[cname] = help
             commands_aliases[cname] = aliases
+            if options is not None:
+                commands_options[cname] = options
         return fn
     return decorator
 
 
+def lazy_command(name: str, target: str, *, alias: str | tuple[str] | None = None, doc: str | None = None,
+                 options: Options | None = None):
+    # target is "module:function"; the module is imported on the first call
+    def load(args: Args):
+        return load_command(name)(args)
+
+    command(name, alias=alias, doc=doc, options=options)(load)
+    for cname in commands_aliases[name]:
+        lazy_commands[cname] = target
+
+
+def load_command(name: str):
+    target = lazy_commands.get(name)
+    if target is None:
+        return commands[name]
+    module_name, fn_name = target.split(":")
+    fn = getattr(importlib.import_module(module_name), fn_name)
+    help = commands_help[name]
+    if help is None and fn.__doc__:
+        help = remove_doc_indent(fn.__doc__)
+    for cname in commands_aliases[name]:
+        lazy_commands.pop(cname, None)
+        commands[cname] = fn
+        commands_help[cname] = help
+    return fn
+
+
 def run_cmd():
     try:
-        cmd()
+        return cmd()
     except Exception as x:
         print_err("Error")
         print_err(x)
         input()
-    window.destroy()
+        return 1
 
 
 def cmd():
-    global history_i, history_enabled, autocomplete_enabled, input_file, input_buffer
-    start_script = ""
-    args = sys.argv[1:]
+    start_script = options.script
     err = False
-    if len(args) >= 1:
-        if not vfs.init(args[0]):
+    failures = 0
+    if options.vfs and os.path.isfile(options.vfs):
+        try:
+            vfs.load(options.vfs)
+        except Exception as x:
+            err = True
+            print_err(f'Cant load snapshot: "{options.vfs}": {x}')
+    elif options.vfs:
+        if not vfs.init(options.vfs):
             err = True
-            print_err(f'Cant open folder: "{args[0]}"')
+            print_err(f'Cant open folder: "{options.vfs}"')
+    if not err and options.vfs and options.writeback:
+        vfs.start_writeback()
     # elif not vfs.init(os.getcwd()):
     #     err = True
     #     print_err("Unexpected error")
-    if len(args) >= 2:
-        start_script = args[1]
     if not err and start_script:
         err = not _load_start_script(start_script)
 
+    if options.profile_startup:
+        import startup
+        print(startup.report())
+
     if err:
         print("Press Enter to exit")
     else:
         print("Hello world!")
 
     while True:
-        history_i = len(history)
-        history_enabled = True
-        autocomplete_enabled = True
         to_new_line()
+        for job in jobs.reap():
+            report_job(job)
         print(vfs.getcwd(), end="", tags=Tags.green)
-        f = False
-        if input_buffer == "":
-            f = True
-            input_buffer = input_file
-        line = input("> ", tags=Tags.blue).strip()
-        if f:
-            input_file = input_buffer
-            input_buffer = ""
-        history_enabled = False
-        autocomplete_enabled = False
-        if err or line == "exit":
-            return
+        if script:
+            line, compiled = script.popleft()
+            print("> ", end="", tags=Tags.blue)
+            print(line)
+        else:
+            line = backend.read_command("> ", [Tags.blue]).strip()
+            compiled = None
+        if err:
+            return 1
+        if line == "exit":
+            for job in jobs.running_jobs():
+                job.cancel()
+                job.done.wait()
+            # jobs that finished since the last prompt
+            for job in jobs.reap():
+                report_job(job)
+            return 1 if failures or failed_jobs else 0
         if line == "":
             continue
-        if line in history:
-            history.remove(line)
         history.append(line)
 
-        try:
-            args = Args.parse(line)
-        except Exception as x:
-            print_err(x)
+        if compiled is None:
+            try:
+                compiled = Compiled(line)
+            except Exception as x:
+                compiled = x
+        if isinstance(compiled, UnknownCommand):
+            print(f'Unknown command: "{compiled}"')
+            failures += 1
             continue
-        if args.cmd not in commands:
-            print(f'Unknown command: "{args.cmd}"')
+        if isinstance(compiled, Exception):
+            print_err(compiled)
+            failures += 1
             continue
 
-        if args.has("/?", "/h", "-h", "--help"):
-            help = commands_help.get(args.cmd, None)
-            aliases = commands_aliases.get(args.cmd, [args.cmd])
-            if help:
-                if len(aliases) > 1:
-                    help = "Aliases: " + ", ".join(aliases) + "\n" + help
-                print(help + "\n")
-            else:
-                print("No help for this command")
+        if compiled.background:
+            job = start_job(compiled.line, compiled.stages(), compiled.redirect)
+            print(f"[{job.id}] {compiled.line}")
             continue
+        try:
+            with jobs.running(jobs.Job(compiled.line)):
+                run_pipeline(compiled.stages(), compiled.redirect)
+        except jobs.Cancelled:
+            print("^C")
+        except Exception as x:
+            print_err(x)
+            failures += 1
 
+
+class UnknownCommand(Exception):
+    pass
+
+
+# A command line parsed once: split into pipeline stages, tokenized and checked against
+# the known commands. Every run gets fresh Args, so one Compiled can be run many times.
+class Compiled:
+    line: str
+    background: bool
+    redirect: tuple[str, str] | None
+    # (tokens, is a help request) for each stage
+    calls: list[tuple[list[str], bool]]
+
+    def __init__(self, line: str):
+        self.line, self.background = Args.split_background(line)
+        stage_lines, self.redirect = Args.split_pipeline(self.line)
+        tokens = [shlex.split(stage) for stage in stage_lines]
+        for cmd, *_ in tokens:
+            if cmd not in commands:
+                raise UnknownCommand(cmd)
+        self.calls = [(cmd_args, any(v in ("/?", "/h", "-h", "--help") for v in cmd_args[1:])) for cmd_args in tokens]
+
+    def stages(self) -> "list[Stage]":
+        # lazy commands are imported here, so a script line that never runs does not load its module
+        return [(print_help if is_help else load_command(cmd_args[0]), Args(cmd_args, commands_options.get(cmd_args[0])))
+                for cmd_args, is_help in self.calls]
+
+
+def compile_script(text: str):
+    # repeated lines are parsed once
+    compiled: dict[str, Compiled | Exception] = {}
+    lines: list[tuple[str, Compiled | Exception | None]] = []
+    for line in text.splitlines():
+        line = line.strip()
+        c = compiled.get(line)
+        if c is None and line and line != "exit":
+            try:
+                c = compiled[line] = Compiled(line)
+            except Exception as x:
+                c = compiled[line] = x
+        lines.append((line, c))
+    return lines
+
+
+def print_help(args: Args):
+    help = commands_help.get(args.cmd, None)
+    aliases = commands_aliases.get(args.cmd, [args.cmd])
+    if help:
+        if len(aliases) > 1:
+            help = "Aliases: " + ", ".join(aliases) + "\n" + help
+        print(help + "\n")
+    else:
+        print("No help for this command")
+
+
+Stage = tuple[Callable[[Args], None], Args]
+
+
+def run_pipeline(stages: list[Stage], redirect: tuple[str, str] | None):
+    # every stage but the last runs on its own thread; stages are connected by bounded
+    # pipes, so a reader that stops early (head) stops the writers before it too
+    sink = None
+    if redirect:
+        op, path = redirect
+        item = vfs.create_file(path)
+        if not item.is_file:
+            raise Exception(f"{path}: Is a directory")
+        sink = pipeline.FileSink(item, append=op == ">>")
+    errors: list[Exception] = []
+    threads: list[threading.Thread] = []
+    source = None
+    for fn, args in stages[:-1]:
+        pipe = pipeline.Pipe()
+        thread = threading.Thread(target=run_stage, args=(fn, args, source, pipe, jobs.current(), vfs.cwd, errors),
+                                  name=f"stage-{args.cmd}", daemon=True)
+        thread.start()
+        threads.append(thread)
+        source = pipe
+    fn, args = stages[-1]
+    try:
+        with pipeline.redirected(source, sink):
+            fn(args)
+    finally:
+        if source:
+            source.close_read()
+        for thread in threads:
+            thread.join()
+        if sink:
+            sink.close_write()
+    if errors:
+        raise errors[0]
+
+
+def run_stage(fn: Callable[[Args], None], args: Args, source: pipeline.Pipe | None, sink: pipeline.Pipe,
+              job: jobs.Job | None, cwd, errors: list[Exception]):
+    jobs.local.job = job
+    vfs.local.cwd = cwd
+    try:
+        with pipeline.redirected(source, sink):
+            fn(args)
+    except jobs.Cancelled:
+        pass
+    except Exception as x:
+        errors.append(x)
+    finally:
+        sink.close_write()
+        if source:
+            source.close_read()
+        jobs.local.job = None
+
+
+def start_job(line: str, stages: list[Stage], redirect: tuple[str, str] | None):
+    cwd = vfs.cwd
+
+    def target():
+        vfs.local.cwd = cwd
         try:
-            commands[args.cmd](args)
+            run_pipeline(stages, redirect)
+            return True
         except Exception as x:
             print_err(x)
+            return False
+
+    return jobs.start(line, target)
+
+
+def report_job(job: jobs.Job):
+    # prints what a finished job wrote while in the background, then its status; True if it failed
+    job.attach(write_job_output)
+    print(job)
+    return count_job(job)
+
+
+def count_job(job: jobs.Job):
+    # failed background jobs make the headless exit code 1, wherever they are collected
+    global failed_jobs
+    if job.status != jobs.FAILED:
+        return False
+    failed_jobs += 1
+    return True
 
 
 def _load_start_script(path: str):
-    global input_file
     try:
         with open(path, "r", encoding="utf8") as f:
-            with lock:
-                input_file = f.read() + "\n"
-                event.set()
+            text = f.read()
     except Exception:
         print(f'Cant open script file: "{path}"')
         return False
+    script.extend(compile_script(text))
     return True
 
 
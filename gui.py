@@ -0,0 +1,621 @@
+import os
+import platform
+import sys
+import threading
+from collections import deque
+import tkinter as tk
+import tkinter.font as tkFont
+from typing import Callable
+
+import console
+import jobs
+from cli import options
+from scrollback import Scrollback
+from vfs import VMODE
+
+username = os.getlogin()
+hostname = platform.node()
+
+folder = "data"
+try:
+    folder = os.path.join(sys._MEIPASS, folder)  # type: ignore
+except Exception:
+    pass
+
+
+def is_windows_11():
+    if sys.platform == "win32":
+        return sys.getwindowsversion().build >= 22000
+    return False
+
+
+def dark_title_bar():
+    if not is_windows_11():
+        return
+    import ctypes as ct
+    window.update()
+    DWMWA_USE_IMMERSIVE_DARK_MODE = 20
+    set_window_attribute = ct.windll.dwmapi.DwmSetWindowAttribute
+    get_parent = ct.windll.user32.GetParent
+    hwnd = get_parent(window.winfo_id())
+    rendering_policy = DWMWA_USE_IMMERSIVE_DARK_MODE
+    value = 2
+    value = ct.c_int(value)
+    set_window_attribute(hwnd, rendering_policy, ct.byref(value), ct.sizeof(value))
+
+
+window = tk.Tk()
+window.title(f"Emulator - {username}@{hostname}")
+window.iconbitmap(os.path.join(folder, "favicon.ico"))
+window.config(bg="#0c0c0c")
+w, h = 900, 500
+x = (window.winfo_screenwidth() - w) // 2
+y = (window.winfo_screenheight() - h) // 2
+window.geometry(f"{w}x{h}+{x}+{y}")
+try:
+    dark_title_bar()
+except Exception:
+    pass
+
+event = threading.Event()
+event_anykey = threading.Event()
+event_anykey_toset = False
+event_anykey.set()
+lock = threading.Lock()
+
+scrollback = Scrollback(options.scrollback, options.scrollback_bytes)
+input_buffer = ""
+rendered_pos = 0
+rendered_line = 0
+output_end_index = "1.0"
+output_queue: deque[tuple[str, object, list[str] | None]] = deque()
+REFRESH_MS = 16
+
+
+def on_text_change(e):
+    global input_buffer
+    if text.edit_modified():
+        if lock.locked():
+            text.edit_modified(False)
+            return
+        with lock:
+            if text.index("output_end") == output_end_index and text.compare(tk.INSERT, ">=", "output_end"):
+                input_buffer = text.get("output_end", "end-1c")
+                if "\n" in input_buffer:
+                    event.set()
+                update_console_text()
+                text.edit_modified(False)
+                return
+            console_text = str(scrollback)
+            new_text = text.get("1.0", tk.END)[:-1]
+            changed_text = new_text[:len(console_text)]
+            to_end = False
+            if console_text == changed_text:
+                input_buffer = new_text[len(console_text):]
+            else:
+                old_text = console_text + input_buffer
+                oldl = len(old_text)
+                newl = len(new_text)
+                si, ei = 0, 1
+                while si < oldl and si < newl and old_text[si] == new_text[si]:
+                    si += 1
+                while oldl - ei > 0 and newl - ei > 0 and old_text[oldl - ei] == new_text[newl - ei]:
+                    ei += 1
+                input_buffer = new_text[si:newl - ei + 1]
+                to_end = True
+            if "\n" in input_buffer:
+                event.set()
+            update_console_text(full=True)
+            if to_end:
+                text.mark_set("insert", "end")
+            text.edit_modified(False)
+
+
+def update_console_text(full: bool = False):
+    global rendered_pos, rendered_line, output_end_index
+    pos = text.index(tk.INSERT)
+    nl = "\n" if input_buffer.endswith("\n") else ""
+    inp = input_buffer.split("\n")[0] + nl if not event.is_set() else ""
+    if full or not scrollback.start <= rendered_pos <= scrollback.end:
+        text.delete("1.0", tk.END)
+        text.mark_set("output_end", "1.0")
+        rendered_pos = scrollback.start
+        rendered_line = scrollback.start_line
+    else:
+        text.delete("output_end", tk.END)
+        if rendered_line < scrollback.start_line:
+            text.delete("1.0", f"{scrollback.start_line - rendered_line + 1}.0")
+            rendered_line = scrollback.start_line
+    start = text.index("output_end")
+    text.insert(tk.END, scrollback.text_from(rendered_pos))
+    for (s, e, tag) in scrollback.tags_from(rendered_pos):
+        text.tag_add(tag, f"{start}+{s - rendered_pos} chars", f"{start}+{e - rendered_pos} chars")
+    rendered_pos = scrollback.end
+    text.mark_set("output_end", "end-1c")
+    output_end_index = text.index("output_end")
+    text.insert(tk.END, inp)
+    text.see(tk.END)
+    text.mark_set("insert", pos)
+
+
+def drain_output():
+    flushed: list[threading.Event] = []
+    with lock:
+        if not output_queue:
+            return
+        full = False
+        move_cursor = False
+        while output_queue:
+            op, value, tags = output_queue.popleft()
+            match op:
+                case "print":
+                    scrollback.append(value, tags)  # type: ignore
+                case "clear":
+                    scrollback.clear(value)  # type: ignore
+                    full = True
+                case "new_line":
+                    if not scrollback.endswith("\n"):
+                        scrollback.append("\n")
+                case "input":
+                    move_cursor = True
+                case "flush":
+                    flushed.append(value)  # type: ignore
+        update_console_text(full)
+        if move_cursor:
+            text.mark_set("insert", "end")
+    for done in flushed:
+        done.set()
+
+
+def refresh_output():
+    drain_output()
+    window.after(REFRESH_MS, refresh_output)
+
+
+def on_key_release(event):
+    global history_back, input_buffer, autocomplete_moveto, ctrl_backspace_moveto, event_anykey_toset, \
+        search_ended_key
+    if event.state & 0x4 and event.keysym == "w":
+        window.destroy()
+        return
+    if search_ended_key is not None and event.keysym == search_ended_key:
+        # the press ended the search and set the input, the release must not replace it
+        search_ended_key = None
+        return "break"
+    if not event_anykey.is_set():
+        if event_anykey_toset:
+            event_anykey_toset = False
+            event_anykey.set()
+        return
+    if event.keysym == "Return":
+        with lock:
+            input_buffer += "\n"
+            update_console_text()
+    elif event.keysym in ("Up", "Down"):
+        pos = get_cursor_input_char_position()
+        if pos < 0:
+            return
+        if not history_enabled:
+            text.mark_set("insert", "end")
+            return
+        # counted from the end, so the history file is not loaded before Up is pressed
+        if event.keysym == "Up":
+            history_back += 1
+        else:
+            history_back -= 1
+        history = console.history
+        history_back = max(min(history_back, len(history)), 1)
+        if len(history) > 0:
+            with lock:
+                input_buffer = history[-history_back]
+                update_console_text()
+        text.mark_set("insert", "end")
+    elif event.state & 0x4 and event.keysym == "Left":
+        pos = get_cursor_input_char_position()
+        if pos < 0:
+            if text.compare("insert linestart", "==", "output_end linestart"):
+                text.mark_set("insert", "output_end")
+    elif event.keysym == "Escape":
+        with lock:
+            history_back = 0
+            input_buffer = ""
+            update_console_text()
+        text.mark_set("insert", "end")
+    elif event.keysym == "Tab":
+        if autocomplete_moveto >= 0:
+            text.mark_set("insert", f"output_end+{autocomplete_moveto} chars")
+            autocomplete_moveto = -1
+    elif event.state & 0x4 and event.keysym == "BackSpace":
+        if ctrl_backspace_moveto >= 0:
+            text.mark_set("insert", f"output_end+{ctrl_backspace_moveto} chars")
+            ctrl_backspace_moveto = -1
+    elif event.keysym == "Home":
+        pos = get_cursor_input_char_position()
+        if pos >= 0:
+            text.mark_set("insert", "output_end")
+
+
+def on_key_press(event):
+    global autocomplete, autocomplete_start, autocomplete_i, autocomplete_items, input_buffer, autocomplete_moveto, \
+        event_anykey_toset, search_ended_key
+    if not event_anykey.is_set():
+        event_anykey_toset = True
+        return "break"
+    search_ended_key = None
+    if search_query is not None and on_search_key(event):
+        return "break"
+    if event.keysym != "Tab":
+        autocomplete = None
+    if event.keysym == "Return":
+        return "break"
+    if event.keysym in ("Up", "Down", "Home"):
+        pos = get_cursor_input_char_position()
+        if pos >= 0:
+            return "break"
+        return
+    if event.keysym in ("Left", "BackSpace"):
+        pos = get_cursor_input_char_position()
+        if pos == 0:
+            return "break"
+        return
+    if not autocomplete_enabled:
+        return
+    if event.keysym != "Tab":
+        return
+    cpos = get_cursor_input_char_position()
+    if cpos < 0:
+        return "break"
+    if autocomplete is None:
+        autocomplete = ""
+        quote = False
+        quoteI = 0
+        for i in range(min(cpos - 1, len(input_buffer))):
+            if input_buffer[i] == '"':
+                quoteI = i
+                quote = not quote
+        if quote:
+            autocomplete = input_buffer[quoteI:cpos]
+            autocomplete_start = quoteI
+        else:
+            i = cpos - 1
+            while i >= 0 and i < len(input_buffer) and input_buffer[i] != " ":
+                autocomplete += input_buffer[i]
+                i -= 1
+            autocomplete_start = i + 1
+            autocomplete = autocomplete[::-1]
+        autocomplete_i = -1
+        autocomplete_items = None
+        autocomplete = autocomplete.replace("\\", "/")
+    if autocomplete_items is None:
+        # found once per Tab cycle, further presses only step through the list
+        autocomplete_items = find_completions(autocomplete, input_buffer[:autocomplete_start].strip() == "")
+    items = autocomplete_items
+    if len(items) == 0:
+        return "break"
+    autocomplete_i = (autocomplete_i + 1) % len(items)
+    item = items[autocomplete_i]
+    if " " in item:
+        if not autocomplete.startswith('"'):
+            autocomplete = '"' + autocomplete
+        item = f'"{item}"'
+    with lock:
+        end = cpos
+        if cpos < len(input_buffer) and input_buffer[cpos] == '"':
+            end += 1
+        input_buffer = input_buffer[:autocomplete_start] + item + input_buffer[end:]
+        autocomplete_moveto = autocomplete_start + len(item)
+        if len(item) > 0 and item[-1] == '"':
+            autocomplete_moveto -= 1
+        update_console_text()
+    return "break"
+
+
+def find_completions(word: str, first: bool):
+    # the first word of the line may also be a command name
+    startswith = word.strip('"')
+    prefix = ""
+    item = console.vfs.cwd
+    if "/" in word:
+        sw = startswith
+        *path, startswith = startswith.split("/")
+        sep = "/" if VMODE else os.path.sep
+        prefix = sep.join(path) + sep
+        if sw.startswith("/"):
+            path[0] = "/"
+        try:
+            item = item.follow_path(path)
+        except Exception as x:
+            console.print(x)
+            return []
+        if not item:
+            return []
+        first = False
+    try:
+        names = item.complete(startswith)
+    except Exception as x:
+        console.print(x)
+        return []
+    if first:
+        names = sorted({*names, *(name for name in console.commands if name.startswith(startswith))})
+    return [prefix + name for name in names] if prefix else names
+
+
+def count_chars(index1: str, index2: str):
+    count = text.count(index1, index2, "chars")
+    if count:
+        return count[0]
+    return 0
+
+
+def get_cursor_input_char_position():
+    if text.compare(tk.INSERT, "<", "output_end"):
+        return -count_chars(tk.INSERT, "output_end")
+    return count_chars("output_end", tk.INSERT)
+
+
+ctrl_backspace_moveto = -1
+ctrl_backspace_chars = (" ", "_", "/", "\\")
+
+
+def ctrl_backspace(event):
+    global input_buffer, ctrl_backspace_moveto
+    pos = get_cursor_input_char_position()
+    if pos < 0:
+        return "break"
+    start = pos - 1
+    sp = start >= 0 and start < len(input_buffer) and input_buffer[start] in ctrl_backspace_chars
+    spch = input_buffer[start] if sp else ""
+    while start >= 0 and start < len(input_buffer) and (
+            (sp and input_buffer[start] == spch) or (not sp and input_buffer[start] not in ctrl_backspace_chars)):
+        start -= 1
+    start += 1
+    with lock:
+        input_buffer = input_buffer[:start] + input_buffer[pos:]
+        update_console_text()
+        ctrl_backspace_moveto = start
+    return "break"
+
+
+def ctrl_delete(event):
+    global input_buffer, ctrl_backspace_moveto
+    pos = get_cursor_input_char_position()
+    if pos < 0:
+        return "break"
+    end = pos
+    sp = end < len(input_buffer) and input_buffer[end] in ctrl_backspace_chars
+    spch = input_buffer[end] if sp else ""
+    while end < len(input_buffer) and (
+            (sp and input_buffer[end] == spch) or (not sp and input_buffer[end] not in ctrl_backspace_chars)):
+        end += 1
+    with lock:
+        input_buffer = input_buffer[:pos] + input_buffer[end:]
+        update_console_text()
+    return "break"
+
+
+search_query: str | None = None
+search_found: tuple[str, int] | None = None
+search_saved = ""
+# Escape, Up or Down that ended the search; its release is skipped
+search_ended_key: str | None = None
+
+
+def on_ctrl_r(e):
+    # reverse incremental search through the history; Ctrl+R again finds an older match
+    global search_query, search_found, search_saved
+    if not history_enabled or get_cursor_input_char_position() < 0:
+        return "break"
+    if search_query is None:
+        search_query = ""
+        search_found = None
+        search_saved = input_buffer
+        show_search()
+    else:
+        find_in_history(search_found[1] if search_found else None)
+    return "break"
+
+
+def on_search_key(event):
+    # True if the key was used by the search; any other key ends it and is handled as usual
+    global search_query, search_ended_key
+    if event.keysym in ("Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R"):
+        return True
+    if event.state & 0x4 and event.keysym in ("g", "G"):
+        end_search(False)
+        return True
+    if event.keysym == "BackSpace":
+        search_query = search_query[:-1]  # type: ignore
+        find_in_history()
+        return True
+    if event.keysym == "Return":
+        end_search(True)
+        return True
+    if event.char and event.char.isprintable() and not event.state & 0x4:
+        search_query += event.char  # type: ignore
+        # the current match is kept while it still matches, as in bash
+        find_in_history(search_found[1] + 1 if search_found else None)
+        return True
+    end_search(event.keysym != "Escape")
+    if event.keysym in ("Escape", "Up", "Down"):
+        search_ended_key = event.keysym
+    return False
+
+
+def find_in_history(before: int | None = None):
+    global search_found
+    found = console.history.search(search_query, before) if search_query else None
+    if found or not search_query:
+        search_found = found
+    show_search(failed=bool(search_query) and not found)
+
+
+def show_search(failed: bool = False):
+    global input_buffer
+    label = "failed reverse-i-search" if failed else "reverse-i-search"
+    with lock:
+        input_buffer = f"({label})`{search_query}': {search_found[0] if search_found else ''}"
+        update_console_text()
+    text.mark_set("insert", "end")
+
+
+def end_search(accept: bool):
+    global search_query, input_buffer
+    line = (search_found[0] if search_found else "") if accept else search_saved
+    search_query = None
+    with lock:
+        input_buffer = line
+        update_console_text()
+    text.mark_set("insert", "end")
+
+
+def on_ctrl_c(e):
+    global input_buffer
+    if text.tag_ranges("sel"):
+        return  # copy the selection as usual
+    if search_query is not None:
+        end_search(False)
+    if not jobs.cancel_foreground():
+        return "break"
+    with lock:
+        input_buffer = ""
+        update_console_text()
+    event.set()
+    event_anykey.set()
+    return "break"
+
+
+def on_resize(e):
+    global text_width, text_height
+    text_width, text_height = e.width, e.height
+
+
+def on_right_click(e):
+    sel_start, sel_end = text.tag_ranges("sel")
+    if sel_start and sel_end:
+        import pyperclip
+        selected_text = text.get(sel_start, sel_end)
+        pyperclip.copy(selected_text)
+        text.tag_remove("sel", "1.0", tk.END)
+
+
+font = tkFont.Font(family="Consolas", size=11)
+char_width = font.measure("0")
+char_height = font.metrics()["linespace"]
+text_width, text_height = 1, 1
+text = tk.Text(window,
+               bg="#0c0c0c",
+               fg="#f3f3f3",
+               insertbackground="#f3f3f3",
+               selectbackground="#f3f3f3",
+               selectforeground="#0c0c0c",
+               font=font,
+               )
+text.mark_set("output_end", "1.0")
+text.mark_gravity("output_end", tk.LEFT)
+text.bind("<<Modified>>", on_text_change)
+text.bind("<KeyRelease>", on_key_release)
+text.bind('<KeyPress>', on_key_press)
+text.bind("<Control-BackSpace>", ctrl_backspace)
+text.bind("<Control-Delete>", ctrl_delete)
+text.bind("<Control-c>", on_ctrl_c)
+text.bind("<Control-C>", on_ctrl_c)
+text.bind("<Control-r>", on_ctrl_r)
+text.bind("<Control-R>", on_ctrl_r)
+text.bind("<Button-3>", on_right_click)
+text.bind("<Configure>", on_resize)
+text.pack(expand=True, fill="both")
+
+text.tag_config("red", foreground="#ff0000")
+text.tag_config("green", foreground="#00ff00")
+text.tag_config("blue", foreground="#1d58ff")
+
+
+
+history_back = 0
+history_enabled = False
+autocomplete: str | None = None
+autocomplete_enabled = False
+autocomplete_i = -1
+autocomplete_items: list[str] | None = None
+autocomplete_start = 0
+autocomplete_moveto = -1
+
+
+def write(text: str, tags: list[str] | None = None):
+    output_queue.append(("print", text, tags))
+
+
+write_err = write
+
+
+def input(prompt: str = "", tags: list[str] | None = None) -> str:
+    global input_buffer
+    write(prompt, tags)
+    while "\n" not in input_buffer:
+        event.clear()
+        output_queue.append(("input", None, None))
+        flush()
+        event.wait()
+        jobs.check_cancel()
+    with lock:
+        i = input_buffer.index("\n")
+        r = input_buffer[:i]
+        output_queue.append(("print", r + "\n", None))
+        input_buffer = input_buffer[i + 1:]
+    return r
+
+
+def read_command(prompt: str = "", tags: list[str] | None = None) -> str:
+    global history_back, history_enabled, autocomplete_enabled
+    history_back = 0
+    history_enabled = True
+    autocomplete_enabled = True
+    line = input(prompt, tags)
+    history_enabled = False
+    autocomplete_enabled = False
+    return line
+
+
+def has_input():
+    return "\n" in input_buffer
+
+
+def flush():
+    if threading.current_thread() is threading.main_thread():
+        drain_output()
+        return
+    done = threading.Event()
+    output_queue.append(("flush", done, None))
+    done.wait()
+
+
+def size():
+    return text_width // char_width - 1, text_height // (char_height + 1)
+
+
+def clear(new_text: str = ""):
+    output_queue.append(("clear", new_text, None))
+
+
+def new_line():
+    output_queue.append(("new_line", None, None))
+
+
+def pause():
+    event_anykey.clear()
+    event_anykey.wait()
+    jobs.check_cancel()
+
+
+def run(main: Callable[[], int]):
+    def target():
+        main()
+        window.destroy()
+
+    t = threading.Thread(target=target)
+    t.daemon = True
+    t.start()
+    text.focus_set()
+    window.after(REFRESH_MS, refresh_output)
+    window.mainloop()
+    sys.exit()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import signal
+import sys
+from typing import Callable
+
+import jobs
+
+at_line_start = True
+
+
+def attach_console():
+    # the windowed emulator.exe starts without stdout/stderr: write to the console of the
+    # cmd.exe that started it, or nowhere if there is none
+    if sys.stdout is not None and sys.stderr is not None:
+        return
+    if sys.platform == "win32":
+        import ctypes
+        if ctypes.windll.kernel32.AttachConsole(-1):  # ATTACH_PARENT_PROCESS
+            sys.stdout = sys.stdout or open("CONOUT$", "w", encoding="utf8")
+            sys.stderr = sys.stderr or open("CONOUT$", "w", encoding="utf8")
+            sys.stdin = sys.stdin or open("CONIN$", "r", encoding="utf8")
+            return
+    sys.stdout = sys.stdout or open(os.devnull, "w", encoding="utf8")
+    sys.stderr = sys.stderr or open(os.devnull, "w", encoding="utf8")
+
+
+attach_console()
+
+
+def write(text: str, tags: list[str] | None = None):
+    global at_line_start
+    if text:
+        sys.stdout.write(text)
+        at_line_start = text.endswith("\n")
+
+
+def write_err(text: str, tags: list[str] | None = None):
+    global at_line_start
+    if text:
+        sys.stdout.flush()
+        sys.stderr.write(text)
+        sys.stderr.flush()
+        at_line_start = text.endswith("\n")
+
+
+def read_line(prompt: str, tags: list[str] | None) -> str | None:
+    write(prompt, tags)
+    line = sys.stdin.readline() if sys.stdin else ""
+    if not line:
+        write("\n")
+        return None
+    line = line.rstrip("\r\n")
+    if not sys.stdin.isatty():
+        write(line + "\n")
+    jobs.check_cancel()
+    return line
+
+
+def input(prompt: str = "", tags: list[str] | None = None) -> str:
+    line = read_line(prompt, tags)
+    return "" if line is None else line
+
+
+def read_command(prompt: str = "", tags: list[str] | None = None) -> str:
+    line = read_line(prompt, tags)
+    return "exit" if line is None else line
+
+
+def has_input():
+    return True
+
+
+def flush():
+    sys.stdout.flush()
+
+
+def size():
+    columns, lines = shutil.get_terminal_size()
+    return columns - 1, lines
+
+
+def clear(new_text: str = ""):
+    write(new_text)
+
+
+def new_line():
+    if not at_line_start:
+        write("\n")
+
+
+def pause():
+    pass
+
+
+def on_sigint(signum, frame):
+    # Ctrl+C cancels the running command; at the prompt it still exits
+    if not jobs.cancel_foreground():
+        raise KeyboardInterrupt
+
+
+def run(main: Callable[[], int]):
+    signal.signal(signal.SIGINT, on_sigint)
+    code = main()
+    flush()
+    sys.exit(code)
@@ -0,0 +1,255 @@
+import atexit
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate, islice
+from typing import Iterator
+
+HISTORY_SIZE = 10000
+SAVE_BATCH = 32
+RECENT = 64
+BLOCK_LINES = 256
+
+
+# Command history without duplicates: running a command again moves it to the end.
+# With a history file, lines are appended to it in batches of SAVE_BATCH (and at exit),
+# and the file is read only when the history is first looked at. `history -c` and
+# `history -d` rewrite the file, so the removed lines are not read back next session.
+class History:
+    # line -> sequence number of its last run, oldest first
+    entries: "OrderedDict[str, int]"
+    unsaved: list[str]
+    # every run line in blocks for search, including lines that ran again later or were dropped
+    index: "list[Block]"
+    # blocks containing the last query, newest first
+    narrowed: "Matches | None"
+
+    def __init__(self, size: int = HISTORY_SIZE, path: str | None = None):
+        self.size = size
+        self.path = path
+        self.entries = OrderedDict()
+        self.unsaved = []
+        self.seq = 0
+        self.__reindex__()
+        self.loaded = path is None
+        # entries as a list for Up/Down and `history -d`, rebuilt after a change
+        self.cached: list[str] | None = None
+        if path is not None:
+            atexit.register(self.flush)
+
+    def append(self, line: str):
+        self.__put__(line)
+        self.__trim__()
+        self.cached = None
+        if self.path is not None:
+            self.unsaved.append(line)
+            if len(self.unsaved) >= SAVE_BATCH:
+                self.flush()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def clear(self):
+        self.__load__()
+        self.entries.clear()
+        self.__reindex__()
+        self.cached = None
+        if self.path is not None:
+            self.__compact__()
+
+    def pop(self, i: int):
+        line = self.lines()[i]
+        self.__drop__(line)
+        self.cached = None
+        if self.path is not None:
+            self.__compact__()
+        return line
+
+    def search(self, query: str, before: int | None = None):
+        # (line, seq) of the latest entry containing query that ran before seq `before`
+        self.__load__()
+        if before is None:
+            before = self.seq + 1
+        narrowed = self.narrowed
+        # typing in Ctrl+R makes the query longer, and a line containing it contains the
+        # previous query too, so only the blocks that matched the previous query are searched
+        if narrowed is None or narrowed.query != query:
+            source = iter(narrowed) if narrowed is not None and narrowed.query in query else reversed(self.index)
+            narrowed = self.narrowed = Matches(query, source)
+        entries = self.entries
+        for block in narrowed:
+            for line, seq in block.find(query):
+                # a line that ran again later is found at its newer position, so older ones are skipped
+                if seq < before and entries.get(line) == seq:
+                    return line, seq
+        return None
+
+    def lines(self) -> list[str]:
+        self.__load__()
+        if self.cached is None:
+            self.cached = list(self.entries)
+        return self.cached
+
+    def __getitem__(self, i):
+        if isinstance(i, int) and -RECENT <= i < 0 and self.cached is None:
+            # Up/Down near the end walk the dict from its tail instead of copying it into a list
+            self.__load__()
+            try:
+                return next(islice(reversed(self.entries), -i - 1, None))
+            except StopIteration:
+                raise IndexError(i)
+        return self.lines()[i]
+
+    def __len__(self):
+        self.__load__()
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __contains__(self, line: object):
+        self.__load__()
+        return line in self.entries
+
+    def flush(self):
+        if not self.unsaved or self.path is None:
+            return
+        lines, self.unsaved = self.unsaved, []
+        try:
+            with open(self.path, "a", encoding="utf8") as f:
+                f.write("".join(line + "\n" for line in lines))
+        except OSError:
+            pass
+
+    def __put__(self, line: str):
+        self.seq += 1
+        entries = self.entries
+        if line in entries:
+            entries.move_to_end(line)
+        entries[line] = self.seq
+        self.narrowed = None
+        index = self.index
+        if len(index[-1].lines) >= BLOCK_LINES:
+            if self.indexed > 2 * len(entries):
+                # mostly lines that ran again later or were dropped
+                self.__reindex__()
+                return
+            index.append(Block([], []))
+        index[-1].add(line, self.seq)
+        self.indexed += 1
+
+    def __drop__(self, line: str):
+        # the line stays in the search index until it is rebuilt, search() skips it
+        del self.entries[line]
+
+    def __trim__(self):
+        while self.size and len(self.entries) > self.size:
+            self.__drop__(next(iter(self.entries)))
+
+    def __reindex__(self):
+        lines = list(self.entries)
+        seqs = list(self.entries.values())
+        self.index = [Block(lines[i:i + BLOCK_LINES], seqs[i:i + BLOCK_LINES])
+                      for i in range(0, len(lines), BLOCK_LINES)] or [Block([], [])]
+        self.indexed = len(lines)
+        self.narrowed = None
+
+    def __load__(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self.path, "r", encoding="utf8") as f:  # type: ignore
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        session = self.entries
+        self.entries = OrderedDict()
+        self.__reindex__()
+        for line in lines:
+            self.__put__(line)
+        for line in session:
+            self.__put__(line)
+        self.__trim__()
+        self.cached = None
+        if len(lines) > 2 * len(self.entries):
+            self.__compact__()
+
+    def __compact__(self):
+        # rewrites the file with the current entries, for removed lines and once it is mostly duplicates
+        self.unsaved = []
+        tmp = self.path + ".tmp"  # type: ignore
+        try:
+            with open(tmp, "w", encoding="utf8") as f:
+                f.write("".join(line + "\n" for line in self.entries))
+            os.replace(tmp, self.path)  # type: ignore
+        except OSError:
+            pass
+
+
+# Up to BLOCK_LINES history lines joined into one string, so a block is searched with a
+# single str.rfind instead of a Python loop over its lines. The string and the line
+# offsets are made when the block is first searched.
+class Block:
+    lines: list[str]
+    seqs: list[int]
+
+    def __init__(self, lines: list[str], seqs: list[int]):
+        self.lines = lines
+        self.seqs = seqs
+        self.joined: str | None = None
+        self.starts: list[int] | None = None
+
+    def add(self, line: str, seq: int):
+        self.lines.append(line)
+        self.seqs.append(seq)
+        self.joined = None
+        self.starts = None
+
+    def text(self):
+        if self.joined is None:
+            self.joined = "\n".join(self.lines)
+        return self.joined
+
+    def find(self, query: str):
+        # lines containing query, newest first
+        if not query or not self.lines:
+            return
+        text = self.text()
+        if self.starts is None:
+            self.starts = [0, *accumulate(len(line) + 1 for line in self.lines)][:-1]
+        starts = self.starts
+        end = len(text)
+        while (pos := text.rfind(query, 0, end)) >= 0:
+            i = bisect_right(starts, pos) - 1
+            yield self.lines[i], self.seqs[i]
+            end = starts[i] - 1
+            if end < 0:
+                return
+
+
+# Blocks containing query, newest first. The source is checked only as far as a search
+# has looked, and a longer query takes its blocks from the Matches of the shorter one.
+class Matches:
+    query: str
+    found: list[Block]
+
+    def __init__(self, query: str, source: Iterator[Block]):
+        self.query = query
+        self.found = []
+        self.source = source
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self.found):
+                yield self.found[i]
+                i += 1
+                continue
+            for block in self.source:
+                if self.query in block.text():
+                    self.found.append(block)
+                    break
+            else:
+                return
@@ -0,0 +1,163 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+RUNNING = "Running"
+DONE = "Done"
+FAILED = "Exit 1"
+CANCELLED = "Interrupt"
+# output a background job keeps until fg/wait; the oldest is dropped beyond it
+OUTPUT_CHARS = 1024 * 1024
+
+
+# BaseException, so the `except Exception` blocks inside commands let it through
+class Cancelled(BaseException):
+    pass
+
+
+class Job:
+    line: str
+    id: int
+    status: str
+    # (text, tags, is error) printed while nobody is watching the job
+    output: deque[tuple[str, list[str] | None, bool]]
+
+    def __init__(self, line: str, id: int = 0):
+        self.line = line
+        self.id = id
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.status = RUNNING
+        self.output = deque()
+        self.output_chars = 0
+        self.dropped = 0
+        self.attached = id == 0
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def buffer(self, text: str, tags: list[str] | None, err: bool):
+        # False once the job is attached to the console and may print directly
+        with self.lock:
+            if self.attached:
+                return False
+            self.output.append((text, tags, err))
+            self.output_chars += len(text)
+            while self.output_chars > OUTPUT_CHARS and len(self.output) > 1:
+                dropped = self.output.popleft()[0]
+                self.output_chars -= len(dropped)
+                self.dropped += len(dropped)
+            return True
+
+    def attach(self, write: Callable[[str, list[str] | None, bool], None]):
+        # the buffered output goes out under the lock, so it stays ahead of later prints
+        with self.lock:
+            if self.dropped:
+                write(f"[{self.id}] {self.dropped} characters of earlier output dropped\n", None, True)
+            for text, tags, err in self.output:
+                write(text, tags, err)
+            self.output.clear()
+            self.output_chars = 0
+            self.dropped = 0
+            self.attached = True
+
+    def __str__(self):
+        return f"[{self.id}]  {self.status:<10}{self.line}"
+
+
+local = threading.local()
+foreground: Job | None = None
+table: dict[int, Job] = {}
+table_lock = threading.Lock()
+
+
+@contextmanager
+def running(job: Job):
+    global foreground
+    local.job = job
+    foreground = job
+    try:
+        yield job
+    finally:
+        local.job = None
+        foreground = None
+
+
+def current() -> Job | None:
+    return getattr(local, "job", None)
+
+
+def check_cancel():
+    # called from print, VFS read loops and copy loops of the running command
+    job = getattr(local, "job", None)
+    if job is not None and job.cancelled.is_set():
+        raise Cancelled()
+
+
+def cancel_foreground():
+    job = foreground
+    if job is None:
+        return False
+    job.cancel()
+    return True
+
+
+def start(line: str, target: Callable[[], bool]):
+    # runs target (True on success) on a worker thread; its output is kept until fg/wait
+    with table_lock:
+        job = Job(line, max(table, default=0) + 1)
+        table[job.id] = job
+
+    def run():
+        local.job = job
+        try:
+            job.status = DONE if target() else FAILED
+        except Cancelled:
+            job.status = CANCELLED
+        except BaseException:
+            job.status = FAILED
+            raise
+        finally:
+            local.job = None
+            job.done.set()
+
+    threading.Thread(target=run, name=f"job-{job.id}", daemon=True).start()
+    return job
+
+
+def get(spec: str | None):
+    # "%N", "N" or None for the most recent job
+    with table_lock:
+        if spec is None:
+            if not table:
+                raise Exception("no current job")
+            return table[max(table)]
+        try:
+            job = table.get(int(spec.removeprefix("%")))
+        except ValueError:
+            job = None
+    if job is None:
+        raise Exception(f"{spec}: no such job")
+    return job
+
+
+def all_jobs():
+    with table_lock:
+        return [table[i] for i in sorted(table)]
+
+
+def reap():
+    # finished jobs leave the table once they have been reported
+    with table_lock:
+        return [table.pop(i) for i in sorted(table) if table[i].done.is_set()]
+
+
+def forget(job: Job):
+    with table_lock:
+        table.pop(job.id, None)
+
+
+def running_jobs():
+    return [job for job in all_jobs() if not job.done.is_set()]
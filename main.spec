@@ -8,7 +8,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[("data", "data"), (path.join(site_packages, "dateparser", "data"), path.join("dateparser", "data"))],
-    hiddenimports=[],
+    hiddenimports=["donut_cmd"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
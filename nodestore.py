@@ -0,0 +1,274 @@
+import threading
+import weakref
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from vfs import Vfs, VfsItem
+
+F_FILE = 1
+F_VIRTUAL = 2
+F_STAT = 4
+DIR_STATE_SHIFT = 3
+DIR_STATE_MASK = 3 << DIR_STATE_SHIFT
+
+
+# The tree as parallel arrays indexed by node id. VfsItem objects are views made on
+# demand and shared while alive, so `is` checks and cache keys keep working.
+class NodeStore:
+    vfs: Vfs
+    names: list[str]
+    name_index: dict[str, int]
+    children: dict[int, dict[int, int]]
+
+    def __init__(self, vfs: Vfs):
+        self.vfs = vfs
+        self.parents = array("i")
+        self.name_ids = array("i")
+        self.flags = bytearray()
+        self.sizes = array("q")
+        self.mtimes = array("d")
+        self.atimes = array("d")
+        self.snaps = array("i")
+        self.names = []
+        self.name_index = {}
+        # loaded directories only: {name id: node id}
+        self.children = {}
+        # state that only a few nodes carry
+        self.contents: dict[int, bytes] = {}
+        self.sources: dict[int, str] = {}
+        self.mod_dates: dict[int, datetime] = {}
+        self.acc_dates: dict[int, datetime] = {}
+        self.paths: dict[int, str] = {}
+        self.reals: dict[int, str] = {}
+        self.name_lists: dict[int, list[str]] = {}
+        self.views: "weakref.WeakValueDictionary[int, VfsView]" = weakref.WeakValueDictionary()
+        # directories may be listed from several threads (cp -r)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.flags)
+
+    def intern(self, name: str):
+        nid = self.name_index.get(name)
+        if nid is None:
+            with self.lock:
+                nid = self.name_index.get(name)
+                if nid is None:
+                    nid = len(self.names)
+                    self.names.append(name)
+                    self.name_index[name] = nid
+        return nid
+
+    def add(self, name: str, parent: "VfsItem | None", is_file: bool):
+        with self.lock:
+            i = len(self.flags)
+            self.parents.append(parent.id if parent else -1)  # type: ignore
+            self.name_ids.append(self.intern(name))
+            self.flags.append(F_FILE if is_file else 0)
+            self.sizes.append(0)
+            self.mtimes.append(0.0)
+            self.atimes.append(0.0)
+            self.snaps.append(-1)
+            return self.view(i)
+
+    def view(self, i: int):
+        with self.lock:
+            item = self.views.get(i)
+            if item is None:
+                item = VfsView(self, i)
+                self.views[i] = item
+            return item
+
+    def nbytes(self):
+        arrays = (self.parents, self.name_ids, self.sizes, self.mtimes, self.atimes, self.snaps)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.flags)
+
+
+class ChildMap(MutableMapping):
+    __slots__ = ("store", "ids")
+
+    def __init__(self, store: NodeStore, ids: dict[int, int]):
+        self.store = store
+        self.ids = ids
+
+    def __getitem__(self, name: str) -> VfsItem:
+        i = self.ids.get(self.store.name_index.get(name, -1))
+        if i is None:
+            raise KeyError(name)
+        return self.store.view(i)
+
+    def __setitem__(self, name: str, item: VfsItem):
+        self.ids[self.store.intern(name)] = item.id  # type: ignore
+
+    def __delitem__(self, name: str):
+        del self.ids[self.store.name_index.get(name, -1)]
+
+    def __contains__(self, name: object):
+        return self.store.name_index.get(name, -1) in self.ids  # type: ignore
+
+    def __iter__(self):
+        # over a copy, as a background job may add children meanwhile
+        names = self.store.names
+        return iter([names[nid] for nid in list(self.ids)])
+
+    def values(self):
+        view = self.store.view
+        return [view(i) for i in list(self.ids.values())]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class VfsView(VfsItem):
+    __slots__ = ("store", "id", "__weakref__")
+    store: NodeStore
+    id: int
+
+    def __init__(self, store: NodeStore, i: int):
+        self.store = store
+        self.id = i
+
+    @property
+    def vfs(self):
+        return self.store.vfs
+
+    @property
+    def name(self):
+        return self.store.names[self.store.name_ids[self.id]]
+
+    @name.setter
+    def name(self, name: str):
+        self.store.name_ids[self.id] = self.store.intern(name)
+
+    @property
+    def parent(self):
+        i = self.store.parents[self.id]
+        return self.store.view(i) if i >= 0 else None
+
+    @parent.setter
+    def parent(self, parent: "VfsView | None"):
+        self.store.parents[self.id] = parent.id if parent else -1
+
+    @property
+    def is_file(self):
+        return bool(self.store.flags[self.id] & F_FILE)
+
+    def __flag__(self, flag: int, value: bool):
+        if value:
+            self.store.flags[self.id] |= flag
+        else:
+            self.store.flags[self.id] &= ~flag
+
+    @property
+    def __virtual__(self):
+        return bool(self.store.flags[self.id] & F_VIRTUAL)
+
+    @__virtual__.setter
+    def __virtual__(self, value: bool):
+        self.__flag__(F_VIRTUAL, value)
+
+    @property
+    def __dir_state__(self):
+        return (self.store.flags[self.id] & DIR_STATE_MASK) >> DIR_STATE_SHIFT
+
+    @__dir_state__.setter
+    def __dir_state__(self, state: int):
+        flags = self.store.flags
+        flags[self.id] = flags[self.id] & ~DIR_STATE_MASK | state << DIR_STATE_SHIFT
+
+    @property
+    def __snap__(self):
+        return self.store.snaps[self.id]
+
+    @__snap__.setter
+    def __snap__(self, i: int):
+        self.store.snaps[self.id] = i
+
+    @property
+    def __names__(self):
+        return self.store.name_lists.get(self.id)
+
+    @__names__.setter
+    def __names__(self, names: list[str] | None):
+        set_sparse(self.store.name_lists, self.id, names)
+
+    @property
+    def __children__(self):
+        ids = self.store.children.get(self.id)
+        return None if ids is None else ChildMap(self.store, ids)
+
+    @__children__.setter
+    def __children__(self, children: "dict[str, VfsItem] | None"):
+        if children is None:
+            self.store.children.pop(self.id, None)
+            return
+        intern = self.store.intern
+        self.store.children[self.id] = {intern(name): item.id for name, item in children.items()}  # type: ignore
+
+    @property
+    def __stat__(self):
+        if not self.store.flags[self.id] & F_STAT:
+            return None
+        return (self.store.sizes[self.id], self.store.mtimes[self.id], self.store.atimes[self.id])
+
+    @__stat__.setter
+    def __stat__(self, st: tuple[int, float, float] | None):
+        self.__flag__(F_STAT, st is not None)
+        if st is not None:
+            self.store.sizes[self.id], self.store.mtimes[self.id], self.store.atimes[self.id] = st
+
+    @property
+    def __file_content__(self):
+        return self.store.contents.get(self.id)
+
+    @__file_content__.setter
+    def __file_content__(self, content: bytes | None):
+        set_sparse(self.store.contents, self.id, content)
+
+    @property
+    def __source__(self):
+        return self.store.sources.get(self.id)
+
+    @__source__.setter
+    def __source__(self, path: str | None):
+        set_sparse(self.store.sources, self.id, path)
+
+    @property
+    def __file_mod_date__(self):
+        return self.store.mod_dates.get(self.id)
+
+    @__file_mod_date__.setter
+    def __file_mod_date__(self, date: datetime | None):
+        set_sparse(self.store.mod_dates, self.id, date)
+
+    @property
+    def __file_acc_date__(self):
+        return self.store.acc_dates.get(self.id)
+
+    @__file_acc_date__.setter
+    def __file_acc_date__(self, date: datetime | None):
+        set_sparse(self.store.acc_dates, self.id, date)
+
+    @property
+    def __path__(self):
+        return self.store.paths.get(self.id)
+
+    @__path__.setter
+    def __path__(self, path: str | None):
+        set_sparse(self.store.paths, self.id, path)
+
+    @property
+    def __real__(self):
+        return self.store.reals.get(self.id)
+
+    @__real__.setter
+    def __real__(self, path: str | None):
+        set_sparse(self.store.reals, self.id, path)
+
+
+def set_sparse(values: dict, i: int, value: object):
+    if value is None:
+        values.pop(i, None)
+    else:
+        values[i] = value
@@ -0,0 +1,129 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from typing import Iterator
+
+from jobs import Cancelled, check_cancel
+from vfs import VfsItem, split_lines
+
+PIPE_CHUNKS = 16
+CHUNK_CHARS = 64 * 1024
+SINK_MEMORY = 4 * 1024 * 1024
+
+
+# raised in a writer once its reader has finished (e.g. `cat big.log | head`), so the
+# writer stops early; a BaseException like Cancelled so commands do not catch it
+class BrokenPipe(Cancelled):
+    pass
+
+
+# Bounded queue of text chunks between two pipeline stages. Prints are batched into
+# chunks of about CHUNK_CHARS, and a writer blocks while PIPE_CHUNKS of them wait for the reader.
+class Pipe:
+    chunks: deque[str]
+    pending: list[str]
+
+    def __init__(self, size: int = PIPE_CHUNKS):
+        self.size = size
+        self.chunks = deque()
+        self.pending = []
+        self.pending_chars = 0
+        self.cond = threading.Condition()
+        self.eof = False
+        self.broken = False
+
+    def write(self, text: str):
+        self.pending.append(text)
+        self.pending_chars += len(text)
+        if self.pending_chars >= CHUNK_CHARS:
+            self.__put__()
+
+    def __put__(self):
+        chunk = "".join(self.pending)
+        self.pending.clear()
+        self.pending_chars = 0
+        with self.cond:
+            while len(self.chunks) >= self.size and not self.broken:
+                self.cond.wait(0.1)
+                check_cancel()
+            if self.broken:
+                raise BrokenPipe()
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def close_write(self):
+        try:
+            if self.pending:
+                self.__put__()
+        except BrokenPipe:
+            pass
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def close_read(self):
+        with self.cond:
+            self.broken = True
+            self.chunks.clear()
+            self.cond.notify_all()
+
+    def read(self):
+        # next chunk, "" once the writer has finished
+        with self.cond:
+            while not self.chunks and not self.eof:
+                self.cond.wait(0.1)
+                check_cancel()
+            if not self.chunks:
+                return ""
+            chunk = self.chunks.popleft()
+            self.cond.notify_all()
+            return chunk
+
+    def iter_text(self) -> Iterator[str]:
+        while chunk := self.read():
+            yield chunk
+
+    def iter_lines(self) -> Iterator[str]:
+        return split_lines(self.iter_text())
+
+
+# `> FILE` and `>> FILE`: the output is stored into the VFS file when the command ends;
+# until then it is kept in a buffer that moves to a temporary host file past SINK_MEMORY bytes
+class FileSink:
+    item: VfsItem
+    buffer: SpooledTemporaryFile
+
+    def __init__(self, item: VfsItem, append: bool):
+        self.item = item
+        self.append = append
+        self.buffer = SpooledTemporaryFile(max_size=SINK_MEMORY)
+
+    def write(self, text: str):
+        self.buffer.write(text.encode("utf8"))
+
+    def close_write(self):
+        with self.buffer:
+            self.buffer.seek(0)
+            self.item.write_bytes(self.buffer.read(), self.append)
+
+
+local = threading.local()
+
+
+def stdin() -> Pipe | None:
+    return getattr(local, "stdin", None)
+
+
+def stdout() -> Pipe | FileSink | None:
+    return getattr(local, "stdout", None)
+
+
+@contextmanager
+def redirected(source: Pipe | None, sink: Pipe | FileSink | None):
+    saved = stdin(), stdout()
+    local.stdin, local.stdout = source, sink
+    try:
+        yield
+    finally:
+        local.stdin, local.stdout = saved
@@ -0,0 +1,104 @@
+from collections import deque
+
+BLOCK_LINES = 256
+
+
+# Console output stored as a ring of line blocks. Offsets (start, end, tag ranges)
+# are absolute positions in the output stream, so evicting blocks never rewrites tags.
+class Scrollback:
+    max_lines: int
+    max_chars: int
+    start: int
+    end: int
+    start_line: int
+    lines: int
+
+    def __init__(self, max_lines: int = 0, max_chars: int = 0):
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.clear()
+
+    def clear(self, text: str = ""):
+        self.blocks: deque[list[str]] = deque()
+        self.block_sizes: deque[int] = deque()
+        self.tags: deque[tuple[int, int, str]] = deque()
+        self.start = 0
+        self.end = 0
+        self.start_line = 0
+        self.lines = 0
+        if text:
+            self.append(text)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return "".join("".join(block) for block in self.blocks)
+
+    def endswith(self, suffix: str):
+        if not self.blocks:
+            return suffix == ""
+        return self.blocks[-1][-1].endswith(suffix)
+
+    def append(self, text: str, tags: list[str] | None = None):
+        if not text:
+            return
+        s = self.end
+        lines = split_lines(text)
+        if self.blocks and not self.blocks[-1][-1].endswith("\n"):
+            self.blocks[-1][-1] += lines[0]
+            self.block_sizes[-1] += len(lines[0])
+            lines = lines[1:]
+        for line in lines:
+            if not self.blocks or len(self.blocks[-1]) >= BLOCK_LINES:
+                self.blocks.append([])
+                self.block_sizes.append(0)
+            self.blocks[-1].append(line)
+            self.block_sizes[-1] += len(line)
+        self.lines += len(lines)
+        self.end += len(text)
+        if tags:
+            for tag in tags:
+                self.tags.append((s, self.end, tag))
+        self.evict()
+
+    def evict(self):
+        while len(self.blocks) > 1 and (
+                (self.max_lines and self.lines - len(self.blocks[0]) >= self.max_lines) or
+                (self.max_chars and len(self) - self.block_sizes[0] >= self.max_chars)):
+            block = self.blocks.popleft()
+            self.start += self.block_sizes.popleft()
+            self.start_line += len(block)
+            self.lines -= len(block)
+        while self.tags and self.tags[0][1] <= self.start:
+            self.tags.popleft()
+
+    def text_from(self, pos: int):
+        pos = max(pos, self.start)
+        parts: list[str] = []
+        line_end = self.end
+        for block in reversed(self.blocks):
+            for line in reversed(block):
+                if line_end <= pos:
+                    return "".join(reversed(parts))
+                line_start = line_end - len(line)
+                parts.append(line[pos - line_start:] if line_start < pos else line)
+                line_end = line_start
+        return "".join(reversed(parts))
+
+    def tags_from(self, pos: int):
+        tags: list[tuple[int, int, str]] = []
+        for (s, e, tag) in reversed(self.tags):
+            if e <= pos:
+                break
+            tags.append((max(s, pos, self.start), e, tag))
+        return reversed(tags)
+
+
+def split_lines(text: str):
+    # lines with their "\n"; only "\n" ends a line, as in the Tk text widget (splitlines also splits on "\r" etc)
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
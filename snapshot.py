@@ -0,0 +1,182 @@
+import mmap
+import os
+import struct
+from datetime import datetime
+
+from vfs import DIR_LOADED, DIR_UNLOADED, Vfs, VfsItem
+
+# Layout: header, fixed-size node records (children of a directory are contiguous),
+# name offsets, utf8 names, in-VFS file contents. Nothing is parsed up front: a
+# directory's records are read when it is first listed.
+MAGIC = b"VFSSNAP2"
+HEADER = struct.Struct("<8sIIIiQQQQ")
+# parent, name, real path (-1 if derived from the parent), source host file (-1 if none),
+# first child, child count (-1 if not saved), flags, size, mtime, atime, mod date, acc date,
+# content offset, length
+NODE = struct.Struct("<iiiiiiBqddddqq")
+NAME_OFFSET = struct.Struct("<QQ")
+
+F_FILE = 1
+F_VIRTUAL = 2
+F_STAT = 4
+F_LOADED = 8
+F_CONTENT = 16
+F_MOD = 32
+F_ACC = 64
+
+
+def save(vfs: Vfs, path: str, full: bool = False):
+    names: list[str] = []
+    name_index: dict[str, int] = {}
+
+    def intern(name: str):
+        nid = name_index.get(name)
+        if nid is None:
+            nid = name_index[name] = len(names)
+            names.append(name)
+        return nid
+
+    roots = list(vfs.volumes.values())
+    nodes: list[VfsItem] = list(roots)
+    parents = [-1] * len(roots)
+    records = bytearray()
+    contents = bytearray()
+    # buffers shared by copies are stored once
+    offsets: dict[int, int] = {}
+    i = 0
+    while i < len(nodes):
+        item = nodes[i]
+        first, count = -1, -1
+        flags = F_FILE if item.is_file else 0
+        if item.is_dir:
+            if full or item.__snap__ >= 0:
+                item.children
+            if item.__dir_state__ != DIR_UNLOADED and item.__children__ is not None:
+                children = list(item.__children__.values())
+                first, count = len(nodes), len(children)
+                nodes.extend(children)
+                parents.extend([i] * count)
+                if item.__dir_state__ == DIR_LOADED:
+                    flags |= F_LOADED
+        if item.__virtual__:
+            flags |= F_VIRTUAL
+        st = item.__stat__
+        if st:
+            flags |= F_STAT
+        real = -1
+        if item.parent and item.__real__ is not None and item.__real__ != item.parent.__child_real_path__(item.name):
+            real = intern(item.__real__)
+        source = intern(item.__source__) if item.__source__ else -1
+        content = item.__file_content__
+        offset = 0
+        if content is not None:
+            flags |= F_CONTENT
+            # empty contents take no space, so they are not shared: their offset is the next file's too
+            offset = offsets.get(id(content), -1) if content else len(contents)
+            if offset < 0:
+                offset = offsets[id(content)] = len(contents)
+                contents += content
+        mod = item.__file_mod_date__
+        acc = item.__file_acc_date__
+        if mod:
+            flags |= F_MOD
+        if acc:
+            flags |= F_ACC
+        records += NODE.pack(parents[i], intern(item.name), real, source, first, count, flags,
+                             *(st or (0, 0.0, 0.0)), mod.timestamp() if mod else 0.0,
+                             acc.timestamp() if acc else 0.0, offset, len(content or b""))
+        i += 1
+
+    cwd = intern(vfs.getcwd())
+    encoded = [name.encode("utf8") for name in names]
+    name_offsets = bytearray()
+    pos = 0
+    for name in encoded:
+        name_offsets += NAME_OFFSET.pack(pos, pos + len(name))
+        pos += len(name)
+    nodes_off = HEADER.size
+    name_offsets_off = nodes_off + len(records)
+    names_off = name_offsets_off + len(name_offsets)
+    content_off = names_off + pos
+    header = HEADER.pack(MAGIC, len(nodes), len(names), len(roots), cwd,
+                         nodes_off, name_offsets_off, names_off, content_off)
+
+    # every directory has been read out of the old snapshot, so it can be unmapped and replaced
+    if vfs.snapshot:
+        vfs.snapshot.close()
+        vfs.snapshot = None
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(records)
+        f.write(name_offsets)
+        for name in encoded:
+            f.write(name)
+        f.write(contents)
+    os.replace(tmp, path)
+
+
+class Snapshot:
+    root_count: int
+    cwd: str
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise Exception("not a VFS snapshot")
+        if len(self.map) < HEADER.size or self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise Exception("not a VFS snapshot")
+        (_, self.node_count, self.name_count, self.root_count, cwd, self.nodes_off,
+         self.name_offsets_off, self.names_off, self.content_off) = HEADER.unpack_from(self.map, 0)
+        self.cwd = self.name(cwd)
+        # (content offset, length) -> bytes, so copies share a buffer again after loading
+        self.buffers: dict[tuple[int, int], bytes] = {}
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def name(self, i: int):
+        start, end = NAME_OFFSET.unpack_from(self.map, self.name_offsets_off + i * NAME_OFFSET.size)
+        return self.map[self.names_off + start:self.names_off + end].decode("utf8")
+
+    def make_item(self, vfs: Vfs, i: int, parent: VfsItem | None):
+        (_, name, real, source, _, count, flags, size, mtime, atime, mod, acc,
+         offset, length) = NODE.unpack_from(self.map, self.nodes_off + i * NODE.size)
+        item = vfs.new_item(self.name(name), parent, is_file=bool(flags & F_FILE))
+        item.__virtual__ = bool(flags & F_VIRTUAL)
+        if flags & F_STAT:
+            item.__stat__ = (size, mtime, atime)
+        if real >= 0:
+            item.__real__ = self.name(real)
+        if source >= 0:
+            item.__source__ = self.name(source)
+        if flags & F_CONTENT:
+            content = self.buffers.get((offset, length))
+            if content is None:
+                start = self.content_off + offset
+                content = self.buffers[offset, length] = self.map[start:start + length]
+            item.__set_content__(content)
+        if flags & F_MOD:
+            item.__file_mod_date__ = datetime.fromtimestamp(mod)
+        if flags & F_ACC:
+            item.__file_acc_date__ = datetime.fromtimestamp(acc)
+        if count >= 0:
+            item.__snap__ = i
+        return item
+
+    def load_children(self, item: VfsItem):
+        # True if the saved listing is complete, False if the host still has to be rescanned
+        i = item.__snap__
+        item.__snap__ = -1
+        _, _, _, _, first, count, flags, *_ = NODE.unpack_from(self.map, self.nodes_off + i * NODE.size)
+        item.__children__ = {}
+        children = item.__children__
+        for k in range(first, first + count):
+            child = self.make_item(item.vfs, k, item)
+            children[child.name] = child
+        return bool(flags & F_LOADED)
@@ -0,0 +1,48 @@
+import builtins
+import sys
+import time
+
+import_times: dict[str, tuple[float, float]] = {}
+started = time.perf_counter()
+_children: list[float] = []
+_original_import = None
+
+
+def install():
+    global _original_import
+    original_import = _original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        _children.append(0.0)
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = _children.pop()
+            if _children:
+                _children[-1] += elapsed
+            import_times.setdefault(name, (elapsed, elapsed - children))
+
+    builtins.__import__ = timed_import
+
+
+def uninstall():
+    global _original_import
+    if _original_import is not None:
+        builtins.__import__ = _original_import
+        _original_import = None
+
+
+def report(limit: int = 20):
+    # startup is over, so later imports run without the timing wrapper
+    uninstall()
+    total = time.perf_counter() - started
+    lines = [f"Startup: {total * 1000:.1f} ms, import time by module (ms):",
+             f"{'cumulative':>10}  {'self':>8}  module"]
+    items = sorted(import_times.items(), key=lambda it: it[1][0], reverse=True)
+    for name, (cumulative, own) in items[:limit]:
+        lines.append(f"{cumulative * 1000:>10.1f}  {own * 1000:>8.1f}  {name}")
+    return "\n".join(lines)
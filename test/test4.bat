@@ -0,0 +1,20 @@
+echo "=== Test 1: Save and load a snapshot with an empty file ==="
+touch /planets/empty.txt
+echo "important data" > /planets/full.txt
+save vfsroot/snap.vfs
+load vfsroot/snap.vfs
+ls /planets
+cat /planets/empty.txt
+cat /planets/full.txt
+
+echo "=== Test 2: Copies share their content after loading ==="
+cp /planets/full.txt /stars/full_copy.txt
+touch /stars/empty_copy.txt
+save vfsroot/snap.vfs
+load vfsroot/snap.vfs
+cat /stars/full_copy.txt
+cat /stars/empty_copy.txt
+cat /planets/mars_log.txt
+
+pause
+exit
\ No newline at end of file
@@ -0,0 +1,35 @@
+echo "=== Test 1: Pipelines ==="
+ls /planets | head -n 2
+cat /dates.txt | head -n 3
+cat /dates.txt | head -n 1 | date -f -
+
+echo "=== Test 2: Redirect output into a file ==="
+ls /planets > /list.txt
+cat /list.txt
+echo "appended line" >> /list.txt
+cat /list.txt
+echo "replaced" > /list.txt
+cat /list.txt
+
+echo "=== Test 3: Redirect a pipeline ==="
+cat /dates.txt | head -n 2 > /first_dates.txt
+cat /first_dates.txt
+
+echo "=== Test 4: Background job ==="
+cp -r /stars /stars_copy &
+wait
+ls /stars_copy
+cat /stars_copy/nova_station/readme.txt
+jobs
+
+echo "=== Test 5: Background pipeline with a redirect ==="
+cat /planets/mars_log.txt | head -n 1 > /log_head.txt &
+wait
+cat /log_head.txt
+
+echo "=== Test 6: Unknown jobs ==="
+fg %5
+wait %5
+
+pause
+exit
\ No newline at end of file
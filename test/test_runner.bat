@@ -1,10 +1,10 @@
 @echo off
 SETLOCAL
-SET test_count=3
+SET test_count=5
 
 IF "%1"=="" (
     echo Error: No index provided.
-    echo Usage: test_runner.bat [index]
+    echo Usage: test_runner.bat [index] [--headless]
     exit /B 1
 )
 IF "%1" LSS "1" (
@@ -49,7 +49,7 @@ echo On the 4th of September, 2025 at 9:15 PM >> vfsroot\dates.txt
 echo September 5th, 2025 23:59 >> vfsroot\dates.txt
 
 echo Running emulator
-..\dist\emulator.exe vfsroot test%1.bat
+..\dist\emulator.exe vfsroot test%1.bat %2
 
 echo Clean up
 rd vfsroot /S /Q
@@ -1,16 +1,240 @@
+import codecs
+import io
+import mmap
 import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator
+
+from jobs import check_cancel
+
+if TYPE_CHECKING:
+    from nodestore import NodeStore
+    from snapshot import Snapshot
+    from writeback import WriteBack
 
 VMODE = True
+DIR_UNLOADED = 0
+DIR_LOADED = 1
+DIR_INVALIDATED = 2
+CHUNK_SIZE = 64 * 1024
+CACHE_SIZE = 64 * 1024 * 1024
+PATH_CACHE_SIZE = 4096
+LIST_WORKERS = 8
+MISSING = object()
+
+
+def split_path(path: str):
+    path = path.replace("\\", "/").strip()
+    parts = [p.strip() for p in path.split("/")]
+    if path == "/":
+        parts = ["/"]
+    elif path.startswith("/"):
+        parts[0] = "/"
+    return parts
+
+
+def scan(path: str):
+    # (name, is file, (size, mtime, atime) or None) of the host folder entries
+    entries: list[tuple[str, bool, tuple[int, float, float] | None]] = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    entries.append((entry.name, entry.is_file(), (st.st_size, st.st_mtime, st.st_atime)))
+                except OSError:
+                    entries.append((entry.name, entry.is_file(), None))
+    except OSError:
+        pass
+    return entries
+
+
+def split_lines(texts: Iterable[str]) -> Iterator[str]:
+    # text chunks to lines, as "".join(texts).split("\n") gives them; the pieces of an
+    # unfinished line are joined only once its "\n" arrives, so a long line is copied once
+    rest: list[str] = []
+    for text in texts:
+        if "\n" not in text:
+            rest.append(text)
+            continue
+        lines = text.split("\n")
+        rest.append(lines[0])
+        yield "".join(rest)
+        yield from islice(lines, 1, len(lines) - 1)
+        rest = [lines[-1]]
+    yield "".join(rest)
+
+
+def load_dirs(items: "list[VfsItem]", workers: int = LIST_WORKERS):
+    # lists every directory under items, one tree level at a time, so host latency overlaps
+    level = [item for item in items if item.is_dir]
+    with ThreadPoolExecutor(workers) as pool:
+        while level:
+            check_cancel()
+            listings = pool.map(lambda item: list(item.children.values()), level)
+            level = [child for children in listings for child in children if child.is_dir]
+
+
+class CopyStats:
+    files: int
+    bytes: int
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def __str__(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        mb = self.bytes / 1024 ** 2
+        return (f"{self.files} files, {mb:.1f} MB in {elapsed:.2f} s "
+                f"({self.files / elapsed:.0f} files/s, {mb / elapsed:.1f} MB/s)")
+
+
+class PathCache:
+    size: int
+    items: "OrderedDict[tuple[VfsItem, str], VfsItem | None]"
+
+    def __init__(self, size: int = PATH_CACHE_SIZE):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, start: "VfsItem", path: str):
+        with self.lock:
+            item = self.items.get((start, path), MISSING)
+            if item is not MISSING:
+                self.items.move_to_end((start, path))
+            return item
+
+    def put(self, start: "VfsItem", path: str, item: "VfsItem | None"):
+        with self.lock:
+            self.items[(start, path)] = item
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class ContentCache:
+    budget: int
+    clean: "OrderedDict[VfsItem, bytes]"
+    dirty: "dict[VfsItem, bytes]"
+    # id(buffer) -> [buffer, items]: copies share one buffer, counted once in dirty_bytes
+    shared: dict[int, list]
+
+    def __init__(self, budget: int = CACHE_SIZE):
+        self.budget = budget
+        self.clean = OrderedDict()
+        self.clean_bytes = 0
+        self.dirty = {}
+        self.shared = {}
+        self.dirty_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, item: "VfsItem"):
+        with self.lock:
+            content = self.clean.get(item)
+            if content is None:
+                self.misses += 1
+                return None
+            self.clean.move_to_end(item)
+            self.hits += 1
+            return content
+
+    def put(self, item: "VfsItem", content: bytes):
+        with self.lock:
+            self.__discard__(item)
+            if len(content) + self.dirty_bytes > self.budget:
+                return
+            self.clean[item] = content
+            self.clean_bytes += len(content)
+            self.__evict__()
+
+    def pin(self, item: "VfsItem", content: bytes):
+        with self.lock:
+            self.__discard__(item)
+            self.__unpin__(item)
+            self.dirty[item] = content
+            ref = self.shared.get(id(content))
+            if ref:
+                ref[1] += 1
+            else:
+                self.shared[id(content)] = [content, 1]
+                self.dirty_bytes += len(content)
+            self.__evict__()
+
+    def discard(self, item: "VfsItem"):
+        with self.lock:
+            self.__discard__(item)
+
+    def forget(self, item: "VfsItem"):
+        with self.lock:
+            self.__discard__(item)
+            self.__unpin__(item)
+
+    def __discard__(self, item: "VfsItem"):
+        content = self.clean.pop(item, None)
+        if content is not None:
+            self.clean_bytes -= len(content)
+
+    def __unpin__(self, item: "VfsItem"):
+        content = self.dirty.pop(item, None)
+        if content is None:
+            return
+        ref = self.shared[id(content)]
+        ref[1] -= 1
+        if not ref[1]:
+            del self.shared[id(content)]
+            self.dirty_bytes -= len(content)
+
+    def __evict__(self):
+        while self.clean and self.clean_bytes + self.dirty_bytes > self.budget:
+            _, content = self.clean.popitem(last=False)
+            self.clean_bytes -= len(content)
+            self.evictions += 1
 
 
 class Vfs:
     volumes: dict[str, "VfsItem"]
-    cwd: "VfsItem"
-
-    def __init__(self) -> None:
-        self.cwd = VfsItem(self, "/", None)
+    cache: ContentCache
+    path_cache: PathCache
+    store: "NodeStore | None"
+    snapshot: "Snapshot | None"
+    writeback: "WriteBack | None"
+
+    def __init__(self, cache_size: int = CACHE_SIZE, compact: bool = False) -> None:
+        self.store = None
+        self.snapshot = None
+        self.writeback = None
+        # background jobs keep their own working directory here
+        self.local = threading.local()
+        # taken for changes to the tree and for loading folders, which background jobs do too
+        self.lock = threading.RLock()
+        if compact:
+            from nodestore import NodeStore
+            self.store = NodeStore(self)
+        self.cwd = self.new_item("/", None)
         self.volumes = {"/": self.cwd}
+        self.cache = ContentCache(cache_size)
+        self.path_cache = PathCache()
+
+    def new_item(self, name: str, parent: "VfsItem | None", *, is_file: bool = False) -> "VfsItem":
+        if self.store is not None:
+            return self.store.add(name, parent, is_file)
+        return VfsNode(self, name, parent, is_file=is_file)
 
     def init(self, path: str):
         path = os.path.abspath(path)
@@ -18,19 +242,56 @@ class Vfs:
             return False
         if VMODE:
             disc = path
-            item = VfsItem(self, disc, None)
+            item = self.new_item(disc, None)
             item.__file_mod_date__ = datetime.now()
             cur = item
         else:
             disc, *parts = path.replace("\\", "/").split("/")
-            item = VfsItem(self, disc, None)
+            item = self.new_item(disc, None)
             cur = item.follow_path(parts)
             if not cur:
                 return False
         self.cwd = cur
         self.volumes = {disc: item}
+        if self.snapshot:
+            self.snapshot.close()
+        self.snapshot = None
+        self.path_cache.clear()
         return True
 
+    def save(self, path: str, full: bool = False):
+        import snapshot
+        snapshot.save(self, path, full)
+
+    def load(self, path: str):
+        # mounts a snapshot written by save(); directories are read from it on first access
+        from snapshot import Snapshot
+        snap = Snapshot(path)
+        self.sync()
+        if self.store is not None:
+            self.store = type(self.store)(self)
+        self.cache = ContentCache(self.cache.budget)
+        old, self.snapshot = self.snapshot, snap
+        roots = [snap.make_item(self, i, None) for i in range(snap.root_count)]
+        self.volumes = {item.name: item for item in roots}
+        self.path_cache.clear()
+        self.cwd = roots[0]
+        self.cwd = self.find(snap.cwd) or roots[0]
+        # the old tree is gone, so nothing reads the old file any more (and Windows can replace it)
+        if old:
+            old.close()
+
+    @property
+    def cwd(self) -> "VfsItem":
+        return getattr(self.local, "cwd", None) or self.__cwd__
+
+    @cwd.setter
+    def cwd(self, item: "VfsItem"):
+        if getattr(self.local, "cwd", None) is not None:
+            self.local.cwd = item
+        else:
+            self.__cwd__ = item
+
     def getcwd(self):
         return self.cwd.path()
 
@@ -76,57 +337,126 @@ class Vfs:
             d = d.add_dir(name)
         return d
 
+    def start_writeback(self):
+        from writeback import WriteBack
+        self.writeback = WriteBack(self)
+
+    def sync(self):
+        # blocks until every queued change is on the host, returns the write errors
+        return self.writeback.flush() if self.writeback else []
+
+    def invalidate(self):
+        for item in self.volumes.values():
+            item.invalidate(recursive=True)
+        self.path_cache.clear()
+
 
+# Node behaviour. The fields below are stored either on the object itself (VfsNode)
+# or in the parallel arrays of a NodeStore (VfsView, see nodestore.py).
 class VfsItem:
+    __slots__ = ()
     vfs: Vfs
     name: str
     parent: "VfsItem | None"
-    is_file: bool = False
+    is_file: bool
 
     @property
     def is_dir(self):
         return not self.is_file
 
-    def __init__(self, vfs: Vfs, name: str, parent: "VfsItem | None", *, is_file: bool = False):
-        self.vfs = vfs
-        self.name = name
-        self.parent = parent
-        self.is_file = is_file
+    __children__: dict[str, "VfsItem"] | None
+    __dir_state__: int
+    # created inside the VFS (add_file/add_dir), so it has no host counterpart
+    __virtual__: bool
 
-    __children__: dict[str, "VfsItem"] | None = None
+    # index of the node in vfs.snapshot while its children are still only there
+    __snap__: int
+    # sorted child names for Tab completion, built on first use and dropped when the children change
+    __names__: list[str] | None
 
     @property
     def children(self) -> dict[str, "VfsItem"]:
-        if self.__children__:
-            return self.__children__
-        self.__children__ = {}
-        if self.is_file:
-            return self.__children__
-        path = self.__real_path__()
-        if os.path.exists(path):
-            for name in os.listdir(path):
-                is_file = os.path.isfile(os.path.join(path, name))
-                item = VfsItem(self.vfs, name, self, is_file=is_file)
-                self.__children__[name] = item
-        return self.__children__
+        if self.__dir_state__ == DIR_LOADED:
+            return self.__children__  # type: ignore
+        with self.vfs.lock:
+            if self.__dir_state__ == DIR_LOADED:
+                return self.__children__  # type: ignore
+            self.__names__ = None
+            if self.__snap__ >= 0 and self.vfs.snapshot.load_children(self):  # type: ignore
+                self.__dir_state__ = DIR_LOADED
+                return self.__children__  # type: ignore
+        # the host folder is read without the lock, so cp -r can list several folders at once
+        entries = [] if self.is_file or self.__virtual__ else scan(self.__real_path__())
+        with self.vfs.lock:
+            if self.__dir_state__ == DIR_LOADED:
+                return self.__children__  # type: ignore
+            old = self.__children__ or {}
+            children: dict[str, VfsItem] = {}
+            for name, is_file, st in entries:
+                item = old.get(name)
+                if item is None or item.is_file != is_file:
+                    item = self.vfs.new_item(name, self, is_file=is_file)
+                if st is not None:
+                    item.__stat__ = st
+                children[name] = item
+            for name, item in old.items():
+                if item.__virtual__ or item.__file_content__ is not None:
+                    children[name] = item
+            # readers skip the lock once the folder is loaded, so the full listing is set in one step
+            self.__children__ = children
+            self.__names__ = None
+            self.__dir_state__ = DIR_LOADED
+            return self.__children__  # type: ignore
+
+    def complete(self, prefix: str) -> list[str]:
+        # child names starting with prefix, in sorted order
+        children = self.children
+        with self.vfs.lock:
+            names = self.__names__
+            if names is None:
+                names = self.__names__ = sorted(children)
+        if not prefix:
+            return list(names)
+        start = bisect_left(names, prefix)
+        # names starting with prefix sort below prefix with its last character incremented
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            return names[start:bisect_left(names, prefix[:-1] + chr(last + 1), start)]
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+    def invalidate(self, recursive: bool = False):
+        # rescan the host directory on the next access, keeping VFS-side changes
+        with self.vfs.lock:
+            if self.__dir_state__ != DIR_LOADED:
+                return
+            self.__dir_state__ = DIR_INVALIDATED
+            self.vfs.path_cache.clear()
+            if recursive:
+                for item in list(self.__children__.values()):  # type: ignore
+                    item.invalidate(recursive=True)
 
     def follow_path(self, path: str | list[str], rem: list[str] | None = None) -> "VfsItem | None":
         if isinstance(path, str):
-            path = path.replace("\\", "/").strip()
-            parts = [p.strip() for p in path.split("/")]
-            if path == "/":
-                parts = ["/"]
-            elif path.startswith("/"):
-                parts[0] = "/"
+            if rem is None:
+                # results are keyed by the start item (usually cwd), so cd needs no invalidation
+                item = self.vfs.path_cache.get(self, path)
+                if item is MISSING:
+                    item = self.follow_path(split_path(path), rem)
+                    self.vfs.path_cache.put(self, path, item)
+                return item  # type: ignore
+            parts = split_path(path)
         else:
             parts = path
         if len(parts) > 0 and (":" in parts[0] or parts[0] == "/"):
-            disc, *parts = parts  # add new disc if exist
+            disc = parts[0]  # add new disc if exist
             if disc == "/":
                 root = self
                 while root.parent:
                     root = root.parent
-                return root.__follow_path__(parts, rem)
+                return root.__follow_path__(parts, 1, rem)
 
             if disc not in self.vfs.volumes:
                 if VMODE:
@@ -134,60 +464,88 @@ class VfsItem:
                 p = os.path.abspath(disc)
                 if not os.path.exists(p):
                     return None
-                item = VfsItem(self.vfs, disc, None)
+                item = self.vfs.new_item(disc, None)
                 self.vfs.volumes[disc] = item
+                self.vfs.path_cache.clear()
+
+            return self.vfs.volumes[disc].__follow_path__(parts, 1, rem)
+        return self.__follow_path__(parts, 0, rem)
 
-            return self.vfs.volumes[disc].__follow_path__(parts, rem)
-        return self.__follow_path__(parts, rem)
-
-    def __follow_path__(self, path: list[str], rem: list[str] | None) -> "VfsItem | None":
-        if len(path) == 0:
-            return self
-        p, *rest = path
-        if p == ".":
-            return self.__follow_path__(rest, rem)
-        if p == "..":
-            if not self.parent:
+    def __follow_path__(self, path: list[str], i: int, rem: list[str] | None) -> "VfsItem | None":
+        cur = self
+        while i < len(path):
+            p = path[i]
+            if p == ".":
+                i += 1
+                continue
+            if p == "..":
+                if not cur.parent:
+                    if rem is not None:
+                        rem.extend(path[i:])
+                        return cur
+                    return None
+                cur = cur.parent
+                i += 1
+                continue
+            child = cur.children.get(p)
+            if child is None:
                 if rem is not None:
-                    rem.extend(path)
-                    return self
+                    rem.extend(path[i:])
+                    return cur
                 return None
-            return self.parent.__follow_path__(rest, rem)
-        if p not in self.children:
-            if rem is not None:
-                rem.extend(path)
-                return self
-            return None
-        return self.children[p].__follow_path__(rest, rem)
+            cur = child
+            i += 1
+        return cur
 
-    def __real_path__(self):
-        if not self.parent:
-            return self.name + os.path.sep
-        cur = self
-        path = [cur.name]
-        while cur.parent:
-            cur = cur.parent
-            path.append(cur.name)
-        return os.path.sep.join(reversed(path))
+    # virtual and host paths, built once from the parent's cached paths
+    __path__: str | None
+    __real__: str | None
 
-    def path(self):
-        if not self.parent:
-            if VMODE:
-                return "/"
-            return self.name + os.path.sep
+    def __build_paths__(self):
+        chain: list[VfsItem] = []
         cur = self
-        path = [cur.name]
-        while cur.parent:
+        while cur.__path__ is None:
+            chain.append(cur)
+            if not cur.parent:
+                break
             cur = cur.parent
-            path.append(cur.name)
-        if VMODE:
-            path[-1] = ""
-        r = os.path.sep.join(reversed(path))
-        if VMODE:
-            r = r.replace("\\", "/")
-        return r
-
-    __file_content__: bytes | None = None
+        for item in reversed(chain):
+            parent = item.parent
+            if not parent:
+                if item.__real__ is None:
+                    item.__real__ = item.name + os.path.sep
+                item.__path__ = "/" if VMODE else item.name + os.path.sep
+                continue
+            if item.__real__ is None:
+                item.__real__ = parent.__child_real_path__(item.name)
+            if VMODE:
+                prefix = parent.__path__ if not parent.parent else parent.__path__ + "/"
+                item.__path__ = prefix + item.name.replace("\\", "/")
+            else:
+                prefix = parent.__path__ if not parent.parent else parent.__path__ + os.path.sep
+                item.__path__ = prefix + item.name
+
+    def __real_path__(self) -> str:
+        if self.__real__ is None:
+            self.__build_paths__()
+        return self.__real__  # type: ignore
+
+    def __child_real_path__(self, name: str):
+        real = self.__real_path__()
+        return (real if not self.parent else real + os.path.sep) + name
+
+    def path(self) -> str:
+        if self.__path__ is None:
+            self.__build_paths__()
+        return self.__path__  # type: ignore
+
+    # in-VFS (dirty) content; clean host content lives in vfs.cache
+    __file_content__: bytes | None
+    # host file a copy reads from until it gets content of its own; __stat__ then holds
+    # the size and mtime the source had at copy time
+    __source__: str | None
+    # (size, mtime, atime) of the host file, captured while scanning the parent
+    __stat__: tuple[int, float, float] | None
 
     def read(self):
         return self.read_bytes().decode("utf8")
@@ -196,75 +554,243 @@ class VfsItem:
         return self.read().split("\n")
 
     def read_bytes(self):
+        content = self.__cached_content__()
+        if content is not None:
+            return content
+        with self.__open_host__() as f:
+            content = f.read()
+        self.vfs.cache.put(self, content)
+        return content
+
+    def __cached_content__(self):
         if self.__file_content__ is not None:
             return self.__file_content__
+        if not self.is_file:
+            return None
+        return self.vfs.cache.get(self)
+
+    def __set_content__(self, data: bytes):
+        with self.__changing__():
+            self.__file_content__ = data
+            self.__source__ = None
+            self.vfs.cache.pin(self, data)
+
+    def __host_file__(self):
+        return self.__source__ or self.__real_path__()
+
+    def __share_content__(self, dest: "VfsItem"):
+        # dest reads the same bytes (or host file) as self; a write to either one
+        # replaces only its own reference
+        with dest.__changing__():
+            content = self.__file_content__
+            if content is not None:
+                dest.__set_content__(content)
+                return
+            path = self.__host_file__()
+            try:
+                st = os.stat(path)
+            except OSError:
+                raise Exception("No such file or directory")
+            if self.__stat__ and self.__stat__[:2] != (st.st_size, st.st_mtime):
+                # the host file changed after it was listed, so copy the bytes self reads
+                dest.__set_content__(self.read_bytes())
+                return
+            dest.__file_content__ = None
+            self.vfs.cache.forget(dest)
+            dest.__source__ = path
+            dest.__stat__ = (st.st_size, st.st_mtime, st.st_atime)
+
+    @contextmanager
+    def __changing__(self):
+        # with --writeback the change is queued for the host once the block ends
+        writeback = self.vfs.writeback
+        if writeback is None:
+            yield
+            return
+        with writeback.lock:
+            yield
+            writeback.mark(self)
+
+    def open(self) -> BinaryIO:
+        content = self.__cached_content__()
+        if content is not None:
+            return io.BytesIO(content)
+        return self.__open_host__()
+
+    def __open_host__(self) -> BinaryIO:
+        # for readers that already missed the cache, so a read counts as one lookup
         if not self.is_file:
             raise Exception("Is a directory")
-        path = self.__real_path__()
+        path = self.__host_file__()
         if not os.path.exists(path):
             raise Exception("No such file or directory")
-        with open(path, "rb") as f:
-            self.__file_content__ = f.read()
-            self.__file_acc_date__ = datetime.now()
-            return self.__file_content__
+        f = open(path, "rb")
+        if self.__source__ and self.__stat__:
+            st = os.fstat(f.fileno())
+            if self.__stat__[:2] != (st.st_size, st.st_mtime):
+                f.close()
+                raise Exception(f"{path}: Changed on the host since it was copied")
+        self.__file_acc_date__ = datetime.now()
+        return f
 
-    __file_mod_date__: datetime | None = None
-    __file_acc_date__: datetime | None = None
+    def size(self):
+        if self.__file_content__ is not None:
+            return len(self.__file_content__)
+        if not self.is_file:
+            raise Exception("Is a directory")
+        if self.__stat__:
+            return self.__stat__[0]
+        return os.path.getsize(self.__host_file__())
+
+    def read_range(self, offset: int, length: int):
+        content = self.__cached_content__()
+        if content is not None:
+            return content[offset:offset + length]
+        with self.__open_host__() as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        content = self.__cached_content__()
+        if content is not None:
+            for i in range(0, len(content), chunk_size):
+                yield content[i:i + chunk_size]
+            return
+        with self.__open_host__() as f:
+            chunk = f.read(chunk_size)
+            if len(chunk) < chunk_size:
+                # small files are read whole anyway, so keep them for the next reader
+                self.vfs.cache.put(self, chunk)
+                if chunk:
+                    yield chunk
+                return
+            yield chunk
+            while chunk := f.read(chunk_size):
+                check_cancel()
+                yield chunk
+
+    def iter_text(self, chunk_size: int = CHUNK_SIZE):
+        decoder = codecs.getincrementaldecoder("utf8")()
+        for chunk in self.iter_chunks(chunk_size):
+            if text := decoder.decode(chunk):
+                yield text
+        if text := decoder.decode(b"", final=True):
+            yield text
+
+    def iter_lines(self, chunk_size: int = CHUNK_SIZE):
+        # same lines as read_lines(), without holding the whole file
+        return split_lines(self.iter_text(chunk_size))
+
+    @contextmanager
+    def mapped(self):
+        # zero-copy view of the host file; slices must not outlive the with block
+        content = self.__cached_content__()
+        if content is not None:
+            yield memoryview(content)
+            return
+        with self.__open_host__() as f:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                yield memoryview(f.read())
+                return
+            with m:
+                view = memoryview(m)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def iter_mapped_lines(self):
+        with self.mapped() as buf:
+            data = buf.obj
+            pos = 0
+            while (end := data.find(b"\n", pos)) >= 0:  # type: ignore
+                check_cancel()
+                yield bytes(buf[pos:end]).decode("utf8")
+                pos = end + 1
+            yield bytes(buf[pos:]).decode("utf8")
+
+    __file_mod_date__: datetime | None
+    __file_acc_date__: datetime | None
 
     def write(self, data: str, append: bool = False):
         self.write_bytes(data.encode("utf8"), append)
 
     def write_bytes(self, data: bytes, append: bool = False):
-        if append and self.__file_content__:
-            self.__file_content__ += data
-        else:
-            self.__file_content__ = data
-        self.__file_mod_date__ = datetime.now()
-        self.__file_acc_date__ = datetime.now()
+        if append:
+            data = self.read_bytes() + data
+        with self.__changing__():
+            self.__set_content__(data)
+            self.__file_mod_date__ = datetime.now()
+            self.__file_acc_date__ = datetime.now()
 
     def get_mod_date(self):
         if self.__file_mod_date__:
             return self.__file_mod_date__
-        modt = os.path.getmtime(self.__real_path__())
+        if self.__stat__:
+            return datetime.fromtimestamp(self.__stat__[1])
+        modt = os.path.getmtime(self.__host_file__())
         return datetime.fromtimestamp(modt)
 
     def set_mod_date(self, date: datetime):
-        self.__file_mod_date__ = date
+        with self.__changing__():
+            self.__file_mod_date__ = date
 
     def get_acc_date(self):
         if self.__file_acc_date__:
             return self.__file_acc_date__
-        access_timestamp = os.path.getatime(self.__real_path__())
+        if self.__stat__:
+            return datetime.fromtimestamp(self.__stat__[2])
+        access_timestamp = os.path.getatime(self.__host_file__())
         return datetime.fromtimestamp(access_timestamp)
 
     def set_acc_date(self, date: datetime):
-        self.__file_acc_date__ = date
+        with self.__changing__():
+            self.__file_acc_date__ = date
 
     def add_file(self, fname: str):
         if "/" in fname or "\\" in fname:
             raise Exception("filename cant contain slashes")
-        item = VfsItem(self.vfs, fname, self, is_file=True)
-        item.__file_content__ = bytes()
-        item.__file_mod_date__ = datetime.now()
-        item.__file_acc_date__ = datetime.now()
-        self.children[fname] = item
+        self.children
+        item = self.vfs.new_item(fname, self, is_file=True)
+        with self.vfs.lock, item.__changing__():
+            children = self.__children__  # a rescan may have replaced the listing meanwhile
+            replaced = children.get(fname)
+            if replaced is not None:
+                self.vfs.cache.forget(replaced)
+            item.__virtual__ = True
+            item.__set_content__(bytes())
+            item.__file_mod_date__ = datetime.now()
+            item.__file_acc_date__ = datetime.now()
+            children[fname] = item
+            self.__names__ = None
+            self.vfs.path_cache.clear()
         return item
 
     def add_dir(self, dname: str):
         if "/" in dname or "\\" in dname:
             raise Exception("dirname cant contain slashes")
-        item = VfsItem(self.vfs, dname, self, is_file=False)
-        item.__file_mod_date__ = datetime.now()
-        item.__file_acc_date__ = datetime.now()
-        self.children[dname] = item
+        self.children
+        item = self.vfs.new_item(dname, self, is_file=False)
+        with self.vfs.lock, item.__changing__():
+            children = self.__children__
+            item.__virtual__ = True
+            item.__file_mod_date__ = datetime.now()
+            item.__file_acc_date__ = datetime.now()
+            children[dname] = item
+            self.__names__ = None
+            self.vfs.path_cache.clear()
         return item
 
     def listdir(self):
         return list(self.children.values()) if self.is_dir else []
 
     def copy_to(self, dest: "VfsItem", recursive: bool = False, overwrite: bool = True,
-                interactive: bool = False, verbose: bool = False, overwrite_name: str | None = None):
+                interactive: bool = False, verbose: bool = False, overwrite_name: str | None = None,
+                stats: CopyStats | None = None):
         from console import input, print
+        check_cancel()
         sep = "/" if VMODE else os.path.sep
         if self.is_file:
             if self.name in dest.children:
@@ -278,7 +804,10 @@ class VfsItem:
                         return
 
             f = dest.add_file(overwrite_name or self.name)
-            f.write(self.read())
+            self.__share_content__(f)
+            if stats:
+                stats.files += 1
+                stats.bytes += f.size()
 
             if verbose:
                 print(f"'{self.path()}' -> '{f.path()}'")
@@ -296,5 +825,30 @@ class VfsItem:
             if verbose:
                 print(f"'{self.path()}{sep}' -> '{new_dir.path()}{sep}'")
 
-            for child in self.children.values():
-                child.copy_to(new_dir, recursive=recursive, overwrite=overwrite, interactive=interactive, verbose=verbose)
+            for child in list(self.children.values()):
+                child.copy_to(new_dir, recursive=recursive, overwrite=overwrite, interactive=interactive,
+                              verbose=verbose, stats=stats)
+
+
+class VfsNode(VfsItem):
+    __slots__ = ("vfs", "name", "parent", "is_file", "__children__", "__dir_state__", "__virtual__", "__snap__",
+                 "__names__", "__path__", "__real__", "__file_content__", "__source__", "__stat__", "__file_mod_date__",
+                 "__file_acc_date__")
+
+    def __init__(self, vfs: Vfs, name: str, parent: VfsItem | None, *, is_file: bool = False):
+        self.vfs = vfs
+        self.name = name
+        self.parent = parent
+        self.is_file = is_file
+        self.__children__ = None
+        self.__dir_state__ = DIR_UNLOADED
+        self.__virtual__ = False
+        self.__snap__ = -1
+        self.__names__ = None
+        self.__path__ = None
+        self.__real__ = None
+        self.__file_content__ = None
+        self.__source__ = None
+        self.__stat__ = None
+        self.__file_mod_date__ = None
+        self.__file_acc_date__ = None
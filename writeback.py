@@ -0,0 +1,157 @@
+import atexit
+import os
+import shutil
+import threading
+import time
+
+from vfs import Vfs, VfsItem
+
+DELAY = 0.5
+TMP_SUFFIX = ".vfs-tmp"
+
+
+# Dirty items are written to the host by a background thread. Changes made within
+# DELAY of each other go out as one batch: file data is written first, then fsynced
+# once per file, renamed into place, and every touched directory is fsynced once.
+class WriteBack:
+    vfs: Vfs
+    dirty: set[VfsItem]
+    errors: list[str]
+
+    def __init__(self, vfs: Vfs, delay: float = DELAY):
+        self.vfs = vfs
+        self.delay = delay
+        self.dirty = set()
+        self.errors = []
+        self.busy = False
+        self.urgent = False
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.writes = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self.__run__, name="vfs-writeback", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def mark(self, item: VfsItem):
+        with self.cond:
+            self.dirty.add(item)
+            self.cond.notify_all()
+
+    def flush(self):
+        with self.cond:
+            self.urgent = True
+            self.cond.notify_all()
+            while self.dirty or self.busy:
+                self.cond.wait()
+            errors, self.errors = self.errors, []
+        return errors
+
+    def __run__(self):
+        while True:
+            with self.cond:
+                while not self.dirty:
+                    self.cond.wait()
+                deadline = time.monotonic() + self.delay
+                while not self.urgent and (left := deadline - time.monotonic()) > 0:
+                    self.cond.wait(left)
+                batch = list(self.dirty)
+                self.dirty.clear()
+                self.urgent = False
+                self.busy = True
+                jobs = [(item, item.__real_path__(), item.__file_content__, item.__source__,
+                         item.__file_mod_date__, item.__file_acc_date__) for item in batch]
+            try:
+                self.__write__(jobs)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.batches += 1
+                    self.cond.notify_all()
+
+    def __write__(self, jobs: list):
+        # parents sort before their children, so new directories exist before their files
+        jobs.sort(key=lambda job: job[1])
+        failed: set[VfsItem] = set()
+        staged = []
+        for job in jobs:
+            item, real, data, source, *_ = job
+            try:
+                if item.is_dir:
+                    os.makedirs(real, exist_ok=True)
+                elif data is not None:
+                    with open(real + TMP_SUFFIX, "wb") as f:
+                        f.write(data)
+                    staged.append(job)
+                elif source:
+                    # copied before any replace below, so the copy keeps the old content of its source
+                    shutil.copyfile(source, real + TMP_SUFFIX)
+                    staged.append(job)
+            except OSError as x:
+                self.__fail__(failed, item, x)
+        # fsync after all the data is written, so the disk sees the batch at once
+        for item, real, *_ in staged:
+            tmp = real + TMP_SUFFIX
+            try:
+                fd = os.open(tmp, os.O_RDWR)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp, real)
+            except OSError as x:
+                self.__fail__(failed, item, x)
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        for d in {os.path.dirname(job[1]) for job in staged}:
+            fsync_dir(d)
+
+        for item, real, data, source, mod, acc in jobs:
+            if item in failed:
+                continue
+            try:
+                if mod or acc:
+                    st = os.stat(real)
+                    os.utime(real, (acc.timestamp() if acc else st.st_atime,
+                                    mod.timestamp() if mod else st.st_mtime))
+                st = os.stat(real)
+            except OSError as x:
+                self.__fail__(failed, item, x)
+                continue
+            self.writes += 1
+            with self.lock:
+                if item in self.dirty:
+                    continue  # changed again while writing, the next batch has the new state
+                item.__virtual__ = False
+                item.__stat__ = (st.st_size, st.st_mtime, st.st_atime)
+                if item.__file_mod_date__ is mod:
+                    item.__file_mod_date__ = None
+                if item.__file_acc_date__ is acc:
+                    item.__file_acc_date__ = None
+                if source and item.__source__ == source:
+                    item.__source__ = None
+                if data is not None and item.__file_content__ is data:
+                    # now backed by the host file, so it can be evicted like any clean content
+                    item.__file_content__ = None
+                    self.vfs.cache.forget(item)
+                    self.vfs.cache.put(item, data)
+
+    def __fail__(self, failed: set[VfsItem], item: VfsItem, x: OSError):
+        failed.add(item)
+        with self.lock:
+            self.errors.append(f"cannot write '{item.path()}': {x.strerror}")
+
+
+def fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # directories cant be opened on Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)